@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import timedelta
+import asyncpg
+from dotenv import load_dotenv
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from flask.sessions import session_json_serializer
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+import pair_scores
+from colors_test import CLOTHING_TYPES, generate_outfit_suggestions, suggest_outfit_for_item
+from db import (DB_CONFIG, DB_POOL_MIN, DB_POOL_MAX, Wardrobe, _ITEM_COLUMNS, _item_from_row, _attach_palettes,
+                _OUTFIT_ITEM_COLUMNS, _OUTFIT_ITEM_JOINS, _GENERATED_OUTFITS_ORDER, _outfits_from_rows,
+                find_similar_items)
+
+# Async JSON API next to the Flask app, for mobile clients and the GUI:
+#     uvicorn api:app --port 8000
+# Requests are signed in with the Flask session cookie, so SECRET_KEY must match app.py.
+
+load_dotenv()
+
+SECRET_KEY = os.environ.get('SECRET_KEY')
+SESSION_COOKIE_NAME = 'session'
+SESSION_LIFETIME = timedelta(days=30)  # PERMANENT_SESSION_LIFETIME in app.py
+SCORING_WORKERS = int(os.getenv('SCORING_WORKERS', 4))  # threads running the outfit engine
+OUTFITS_PER_PAGE = 48
+MAX_OUTFITS_PER_PAGE = 200
+SIMILAR_ITEMS = 10
+MAX_SIMILAR_ITEMS = 100
+CLOTHING_TYPE_PATTERN = f"^({'|'.join(CLOTHING_TYPES)})$"
+
+# Same signing scheme as Flask's SecureCookieSessionInterface
+session_serializer = URLSafeTimedSerializer(
+    SECRET_KEY or os.urandom(24),
+    salt='cookie-session',
+    serializer=session_json_serializer,
+    signer_kwargs={'key_derivation': 'hmac', 'digest_method': hashlib.sha1}
+)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.db = await asyncpg.create_pool(
+        host=DB_CONFIG['host'], port=DB_CONFIG['port'], database=DB_CONFIG['dbname'],
+        user=DB_CONFIG['user'], password=DB_CONFIG['password'],
+        min_size=DB_POOL_MIN, max_size=DB_POOL_MAX
+    )
+    app.state.executor = ThreadPoolExecutor(max_workers=SCORING_WORKERS, thread_name_prefix='scoring')
+    try:
+        yield
+    finally:
+        app.state.executor.shutdown(wait=False, cancel_futures=True)
+        await app.state.db.close()
+
+
+app = FastAPI(title="Smart Wardrobe API", lifespan=lifespan)
+
+
+async def current_user(request: Request):
+    """The signed-in user from the Flask session cookie, or 401."""
+    cookie = request.cookies.get(SESSION_COOKIE_NAME)
+    if not cookie:
+        raise HTTPException(status_code=401, detail="Not signed in")
+    try:
+        data = session_serializer.loads(cookie, max_age=int(SESSION_LIFETIME.total_seconds()))
+    except BadSignature:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    user = data.get('user')
+    if not user or not user.get('wardrobe_id'):
+        raise HTTPException(status_code=401, detail="Not signed in")
+    return user
+
+
+def score_outfits(wardrobe_id, wardrobe, item=None, limit=None, offset=0):
+    matrix = pair_scores.get_pair_scores(wardrobe_id, wardrobe)
+    if item:
+        return suggest_outfit_for_item(item, wardrobe, pair_scores=matrix, limit=limit, offset=offset)
+    return generate_outfit_suggestions(wardrobe, pair_scores=matrix, limit=limit, offset=offset)
+
+
+async def fetch_wardrobe(conn, wardrobe_id):
+    rows = await conn.fetch(f"""
+        SELECT {_ITEM_COLUMNS}
+        FROM clothing_items
+        WHERE wardrobe_id = $1
+        ORDER BY type, id
+    """, wardrobe_id)
+    wardrobe = Wardrobe()
+    for row in rows:
+        wardrobe.add(_item_from_row(tuple(row)))
+    rows = await conn.fetch("""
+        SELECT p.item_id, p.r, p.g, p.b, p.weight
+        FROM clothing_item_palette p
+        JOIN clothing_items c ON c.id = p.item_id
+        WHERE c.wardrobe_id = $1
+        ORDER BY p.item_id, p.position
+    """, wardrobe_id)
+    _attach_palettes(wardrobe, [tuple(row) for row in rows])
+    return wardrobe
+
+
+async def fetch_item(conn, wardrobe_id, item_id):
+    row = await conn.fetchrow(f"""
+        SELECT {_ITEM_COLUMNS}
+        FROM clothing_items
+        WHERE id = $1 AND wardrobe_id = $2
+    """, item_id, wardrobe_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return _item_from_row(tuple(row))
+
+
+async def outfit_page(request, wardrobe_id, item=None, limit=OUTFITS_PER_PAGE, offset=0):
+    """
+    Best outfits first, optionally only those with item. Read from generated_outfits
+    once the wardrobe is materialized, otherwise scored in the executor.
+    """
+    async with request.app.state.db.acquire() as conn:
+        materialized = await conn.fetchval("SELECT outfits_materialized FROM wardrobe WHERE id = $1", wardrobe_id)
+        if materialized:
+            item_id = item['id'] if item else None
+            # one extra row tells whether there is a next page
+            rows = await conn.fetch(f"""
+                SELECT o.score, {_OUTFIT_ITEM_COLUMNS}
+                FROM generated_outfits o
+                {_OUTFIT_ITEM_JOINS}
+                WHERE o.wardrobe_id = $1
+                  AND ($2::int IS NULL OR $2 IN (o.top_id, o.pant_id, o.shoe_id, o.jacket_id))
+                ORDER BY {_GENERATED_OUTFITS_ORDER}
+                LIMIT $3 OFFSET $4
+            """, wardrobe_id, item_id, limit + 1, offset)
+            outfits = _outfits_from_rows([tuple(row) for row in rows])
+        else:
+            wardrobe = await fetch_wardrobe(conn, wardrobe_id)
+            if item:
+                # the wardrobe's copy has its palette attached, fetch_item's does not
+                item = wardrobe.by_id.get(item['id'], item)
+
+    if not materialized:
+        # the engine is CPU-bound; keep it off the event loop
+        loop = asyncio.get_running_loop()
+        outfits = await loop.run_in_executor(request.app.state.executor, score_outfits,
+                                             wardrobe_id, wardrobe, item, limit + 1, offset)
+
+    return {
+        'outfits': outfits[:limit],
+        'limit': limit,
+        'offset': offset,
+        'has_next': len(outfits) > limit
+    }
+
+
+@app.get("/api/wardrobe")
+async def wardrobe(request: Request, user: dict = Depends(current_user)):
+    async with request.app.state.db.acquire() as conn:
+        return await fetch_wardrobe(conn, user['wardrobe_id'])
+
+
+@app.get("/api/items/{item_id}")
+async def item(item_id: int, request: Request, user: dict = Depends(current_user)):
+    async with request.app.state.db.acquire() as conn:
+        return await fetch_item(conn, user['wardrobe_id'], item_id)
+
+
+@app.get("/api/items/{item_id}/outfits")
+async def item_outfits(item_id: int, request: Request, user: dict = Depends(current_user),
+                       limit: int = Query(OUTFITS_PER_PAGE, ge=1, le=MAX_OUTFITS_PER_PAGE),
+                       offset: int = Query(0, ge=0)):
+    async with request.app.state.db.acquire() as conn:
+        chosen = await fetch_item(conn, user['wardrobe_id'], item_id)
+    return await outfit_page(request, user['wardrobe_id'], chosen, limit, offset)
+
+
+async def similar_page(request, wardrobe_id, rgb, limit, clothing_type, exclude_id=None):
+    # the colour index lives in wardrobe_cache, which is synchronous
+    loop = asyncio.get_running_loop()
+    matches = await loop.run_in_executor(request.app.state.executor, find_similar_items,
+                                         wardrobe_id, rgb, limit, clothing_type, exclude_id)
+    return {'rgb': rgb, 'items': [dict(it, distance=distance) for distance, it in matches]}
+
+
+@app.get("/api/items/{item_id}/similar")
+async def item_similar(item_id: int, request: Request, user: dict = Depends(current_user),
+                       limit: int = Query(SIMILAR_ITEMS, ge=1, le=MAX_SIMILAR_ITEMS),
+                       clothing_type: str = Query(None, alias='type', pattern=CLOTHING_TYPE_PATTERN)):
+    async with request.app.state.db.acquire() as conn:
+        chosen = await fetch_item(conn, user['wardrobe_id'], item_id)
+    return await similar_page(request, user['wardrobe_id'], chosen['rgb'], limit, clothing_type, exclude_id=item_id)
+
+
+@app.get("/api/similar")
+async def similar(request: Request, user: dict = Depends(current_user),
+                  r: int = Query(ge=0, le=255), g: int = Query(ge=0, le=255), b: int = Query(ge=0, le=255),
+                  limit: int = Query(SIMILAR_ITEMS, ge=1, le=MAX_SIMILAR_ITEMS),
+                  clothing_type: str = Query(None, alias='type', pattern=CLOTHING_TYPE_PATTERN)):
+    return await similar_page(request, user['wardrobe_id'], (r, g, b), limit, clothing_type)
+
+
+@app.get("/api/outfits/generated")
+async def generated_outfits(request: Request, user: dict = Depends(current_user),
+                            limit: int = Query(OUTFITS_PER_PAGE, ge=1, le=MAX_OUTFITS_PER_PAGE),
+                            offset: int = Query(0, ge=0)):
+    return await outfit_page(request, user['wardrobe_id'], limit=limit, offset=offset)
+
+
+@app.get("/api/outfits/saved")
+async def saved_outfits(request: Request, user: dict = Depends(current_user)):
+    async with request.app.state.db.acquire() as conn:
+        rows = await conn.fetch(f"""
+            SELECT o.score, {_OUTFIT_ITEM_COLUMNS}
+            FROM Outfit o
+            {_OUTFIT_ITEM_JOINS}
+            WHERE o.wardrobe_id = $1
+            ORDER BY o.score DESC, o.id
+        """, user['wardrobe_id'])
+    return {'outfits': _outfits_from_rows([tuple(row) for row in rows])}
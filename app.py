@@ -1,6 +1,7 @@
-from flask import Flask, render_template, request, redirect, session, url_for, flash
+from flask import (Flask, render_template, stream_template, request, redirect, session, url_for, flash, jsonify,
+                   make_response, abort, g, get_flashed_messages)
 from werkzeug.utils import secure_filename
-from flask_wtf.csrf import CSRFProtect
+from flask_wtf.csrf import CSRFProtect, generate_csrf
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from email_validator import validate_email, EmailNotValidError
@@ -9,10 +10,16 @@ from itsdangerous import URLSafeTimedSerializer
 from datetime import timedelta
 from functools import wraps
 import os
-from db import *
-from colors_test import suggestions_for_item, suggest_outfit_for_item, get_dominant_color, _closest_color_name, generate_outfit_suggestions
 from PIL import Image
-import random
+from db import *
+from colors_test import suggestions_for_item, _closest_color_name, generate_color_box_png, get_palette, CLOTHING_TYPES, OUTFIT_SCORING
+from elk_logger import log_outfit_to_elasticsearch
+from upload_jobs import upload_queue, process_batch_upload, PENDING, DONE, FAILED
+from thumbnails import make_variants, thumbnail_filename, THUMBNAIL_FORMAT
+import click
+import time
+import metrics
+from metrics import Histogram
 from datetime import date
 
 load_dotenv()
@@ -47,16 +54,80 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+MAX_BATCH_UPLOAD_FILES = 100
+
+OUTFITS_PER_PAGE = 48
+MAX_OUTFITS_PER_PAGE = 200
+SIMILAR_ITEMS = 4  # closest colours shown on an item's page
+
+def get_page_args():
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', OUTFITS_PER_PAGE, type=int), 1), MAX_OUTFITS_PER_PAGE)
+    return page, limit
+
+class PageInfo:
+    """
+    Pagination of a streamed page. has_next is only known once the outfits have
+    been rendered, so paged() sets it and the template reads it after the loop.
+    """
+    def __init__(self, page, limit):
+        self.page = page
+        self.limit = limit
+        self.has_next = False
+
+def paged(outfits, page_info):
+    # outfits holds one extra outfit, which only tells whether there is a next page
+    try:
+        for count, outfit in enumerate(outfits):
+            if count == page_info.limit:
+                page_info.has_next = True
+                break
+            yield outfit
+    finally:
+        outfits.close()  # hands the database connection back
+
+STREAM_BUFFER_SIZE = 8192  # characters sent per chunk of a streamed page
+
+def stream_page(template_name, **context):
+    """
+    stream_template, with Jinja's many small pieces joined into chunks of about
+    STREAM_BUFFER_SIZE, so the first outfits reach the browser without building the page.
+    """
+    # The session cookie goes out before the body, so anything the template would
+    # change in the session (flashes shown, the CSRF token) has to happen now
+    get_flashed_messages()
+    generate_csrf()
+
+    pieces = stream_template(template_name, **context)  # keeps the request context while iterated
+
+    def chunks():
+        buffer, size = [], 0
+        for piece in pieces:
+            buffer.append(piece)
+            size += len(piece)
+            if size >= STREAM_BUFFER_SIZE:
+                yield ''.join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield ''.join(buffer)
+    return app.response_class(chunks(), mimetype='text/html')
+
+@app.template_filter('thumbnail')
+def thumbnail_filter(filename, size, thumbnail_format=None):
+    # sized variant of an upload, or the original while its row records none
+    return thumbnail_filename(filename, size, thumbnail_format)
+
 mail = Mail(app)
 s = URLSafeTimedSerializer(app.secret_key)
 
 class User():
-    def __init__(self, id, username, email, wardrobe_id, profile_pic):
+    def __init__(self, id, username, email, wardrobe_id, profile_pic, profile_pic_thumbnail_format=None):
         self.id = id
         self.username = username
         self.email = email
         self.wardrobe_id = wardrobe_id
         self.profile_pic = profile_pic or "profile_pic_default.png"
+        self.profile_pic_thumbnail_format = profile_pic_thumbnail_format if profile_pic else None
     
     def to_dict(self):
         return {
@@ -64,7 +135,8 @@ class User():
             'username': self.username,
             'email': self.email,
             'wardrobe_id': self.wardrobe_id,
-            'profile_pic': self.profile_pic
+            'profile_pic': self.profile_pic,
+            'profile_pic_thumbnail_format': self.profile_pic_thumbnail_format
         }
 
     @staticmethod
@@ -74,7 +146,8 @@ class User():
             username=data['username'],
             email=data['email'],
             wardrobe_id=data['wardrobe_id'],
-            profile_pic=data.get('profile_pic', 'profile_pic_default.png')
+            profile_pic=data.get('profile_pic', 'profile_pic_default.png'),
+            profile_pic_thumbnail_format=data.get('profile_pic_thumbnail_format')
         )
 
 def send_confirmation_email(email, username):
@@ -106,6 +179,45 @@ limiter = Limiter(
     default_limits=["200 per day", "50 per hour"]
 )
 
+# Request latency per route (endpoint name), see /metrics
+REQUEST_SECONDS = Histogram('http_request_seconds', 'Request latency', ('endpoint', 'method', 'status'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # when set, /metrics requires "Authorization: Bearer <token>"
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    if response.is_streamed:
+        # the body (cursor reads, template rendering) is produced after this returns,
+        # so streamed pages are measured until the server has sent them
+        started = g.pop('request_started', None)
+        if started is not None:
+            labels = (request.endpoint or 'unmatched', request.method, str(response.status_code))
+            response.call_on_close(lambda: REQUEST_SECONDS.observe(time.perf_counter() - started, *labels))
+    else:
+        _observe_request(response.status_code)
+    return response
+
+@app.teardown_request
+def record_failed_request_time(error):
+    # unhandled exceptions skip after_request
+    if error is not None:
+        _observe_request(500)
+
+def _observe_request(status):
+    started = g.pop('request_started', None)
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, request.endpoint or 'unmatched', request.method, str(status))
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        abort(401)
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
 @app.route('/')
 def home():
     return render_template('home.html')
@@ -142,7 +254,8 @@ def login():
                 username=info[1],
                 email=info[3],
                 wardrobe_id=wardrobe_id,
-                profile_pic=info[5]
+                profile_pic=info[5],
+                profile_pic_thumbnail_format=info[6]
             )
             
             session['user'] = user.to_dict()
@@ -203,23 +316,34 @@ def edit_profile():
     file = request.files.get('profile_pic')
 
     profile_pic_filename = user.profile_pic  # default to current
+    thumbnail_format = user.profile_pic_thumbnail_format
 
     if file and allowed_file(file.filename):
         filename = secure_filename(f"user_{user.id}.{file.filename.rsplit('.', 1)[1].lower()}")
         file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
         profile_pic_filename = filename
+        # the picture is kept even when it cannot be resized; pages then show the original
+        try:
+            make_variants(app.config['UPLOAD_FOLDER'], filename)
+            thumbnail_format = THUMBNAIL_FORMAT
+        except Exception as e:
+            print(f"Thumbnails for {filename} failed:", e)
+            flash("⚠️ Could not read the picture to make its thumbnails.", "warning")
+            thumbnail_format = None
 
     try:
         update_user_account(
             user_id=user.id,
             username=new_username if new_username != user.username else None,
             password=new_password if new_password else None,
-            profile_pic=profile_pic_filename
+            profile_pic=profile_pic_filename,
+            profile_pic_thumbnail_format=thumbnail_format
         )
 
         # refresh session
         user.username = new_username
         user.profile_pic = profile_pic_filename
+        user.profile_pic_thumbnail_format = thumbnail_format
         session['user'] = user.to_dict()
 
         flash("✅ Profile updated successfully.", "success")
@@ -244,26 +368,38 @@ def delete_account():
 @login_required
 def wardrobe():
     user = User.from_dict(session['user'])
+
+    # Report uploads that finished since the last visit, keep showing the pending ones
+    pending_uploads = []
+    for job_id in session.get('upload_jobs', []):
+        job = upload_queue.status(job_id)
+        if not job or job['wardrobe_id'] != user.wardrobe_id:
+            continue
+        if job['status'] == PENDING:
+            pending_uploads.append(job)
+        elif job['status'] == DONE:
+            flash(f"✅ Added {job['color_name']} {job['rgb']} to {job['category']}.", "success")
+        else:
+            flash(f"❌ Failed to process {job['filename']}.", "danger")
+    session['upload_jobs'] = [job['id'] for job in pending_uploads]
+
     items = fetch_wardrobe_items(user.wardrobe_id)
-    return render_template('wardrobe.html', items=items, username=user.username, closest_color_name=_closest_color_name)
+    return render_template('wardrobe.html', items=items, username=user.username, closest_color_name=_closest_color_name,
+                           pending_uploads=pending_uploads)
 
 @app.route('/item/<int:item_id>')
 @login_required
 def item(item_id):
-    wardrobe = fetch_wardrobe_items(session['user']['wardrobe_id'])
-    item_chosen = {}
-    for item_type, items in wardrobe.items():
-        for item in items:
-            if item['id'] == item_id:
-                item_chosen = {
-                        'id': item_id,
-                        'type': item_type,
-                        'rgb': item['rgb'],
-                        'image': item['image']
-                    }
-    outfits = suggest_outfit_for_item(item_chosen, wardrobe)
-    suggestions = suggestions_for_item({item_chosen['type']: item_chosen['rgb']})
-    return render_template('item.html', item=item_chosen, outfits= outfits, suggestions=suggestions, closest_color_name=_closest_color_name)
+    wardrobe_id = session['user']['wardrobe_id']
+    item_chosen = fetch_wardrobe_items(wardrobe_id).by_id.get(item_id)
+    if not item_chosen:
+        abort(404)
+    ensure_generated_outfits(wardrobe_id)
+    outfits = fetch_generated_outfits(wardrobe_id, item_id=item_id, limit=3)
+    suggestions = suggestions_for_item({item_chosen['type']: item_chosen['rgb']}, swatch_image=swatch_url)
+    similar = find_similar_items(wardrobe_id, item_chosen['rgb'], limit=SIMILAR_ITEMS, exclude_id=item_id)
+    return render_template('item.html', item=item_chosen, outfits= outfits, suggestions=suggestions, similar=similar,
+                           closest_color_name=_closest_color_name)
     
 @app.route('/upload', methods=['POST'])
 @login_required
@@ -282,34 +418,83 @@ def upload():
         return redirect(url_for('wardrobe'))
 
     user = User.from_dict(session['user'])
+    file_path, filename = save_upload(file, category, user)
+
+    # Color extraction and DB insert run in the background, see upload_jobs.py
+    job_id = upload_queue.submit(user.wardrobe_id, category, file_path, filename)
+    session['upload_jobs'] = session.get('upload_jobs', []) + [job_id]
+
+    return redirect(url_for('wardrobe'))
 
+def save_upload(file, category, user):
     # Generate safe and unique filename
     ext = file.filename.rsplit('.', 1)[1].lower()
     raw_name = secure_filename(file.filename.rsplit('.', 1)[0])
     filename = secure_filename(f"{category}_{user.id}_{raw_name}.{ext}")
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     file.save(file_path)
+    return file_path, filename
 
-    # Extract dominant color
-    try:
-        image = Image.open(file_path).convert('RGB')
-        rgb = get_dominant_color(image)
-    except Exception as e:
-        print("Image processing error:", e)
-        flash("Failed to process the image.", "danger")
+@app.route('/upload/batch', methods=['POST'])
+@login_required
+def upload_batch():
+    """
+    Many images in one request: 'images' files with either one 'category' for all of them
+    or one 'categories' value per file. Colors are extracted in parallel and the items
+    inserted together; the response reports every file (JSON when asked for it).
+    """
+    files = [f for f in request.files.getlist('images') if f and f.filename]
+    categories = request.form.getlist('categories') or [request.form.get('category')] * len(files)
+    wants_json = request.accept_mimetypes.best == 'application/json'
+
+    if not files or len(categories) != len(files):
+        message = "Images and a category for each of them are required."
+    elif len(files) > MAX_BATCH_UPLOAD_FILES:
+        message = f"At most {MAX_BATCH_UPLOAD_FILES} images can be uploaded at once."
+    else:
+        message = None
+    if message:
+        if wants_json:
+            return jsonify({'error': message}), 400
+        flash(message, "danger")
         return redirect(url_for('wardrobe'))
 
-    # Save to DB with filename
-    try:
-        insert_clothing_item(user.wardrobe_id, category, rgb, filename)
-        color_name = _closest_color_name(rgb)
-        flash(f"✅ Added {color_name} {rgb} to {category}.", "success")
-    except Exception as e:
-        print("Database insert error:", e)
-        flash("❌ Failed to save clothing item.", "danger")
+    user = User.from_dict(session['user'])
+    results = [None] * len(files)
+    uploads, positions = [], []
+    for i, (file, category) in enumerate(zip(files, categories)):
+        if category not in CLOTHING_TYPES:
+            results[i] = {'filename': file.filename, 'category': category, 'status': FAILED, 'error': "Unknown category"}
+        elif not allowed_file(file.filename):
+            results[i] = {'filename': file.filename, 'category': category, 'status': FAILED, 'error': "Invalid file type"}
+        else:
+            uploads.append((category, *save_upload(file, category, user)))
+            positions.append(i)
+
+    for i, result in zip(positions, process_batch_upload(user.wardrobe_id, uploads)):
+        results[i] = result
 
+    if wants_json:
+        return jsonify({'results': results})
+
+    added = [r for r in results if r['status'] == DONE]
+    if added:
+        flash(f"✅ Added {len(added)} of {len(results)} item(s).", "success")
+    for r in results:
+        if r['status'] != DONE:
+            flash(f"❌ {r['filename']}: {r['error']}", "danger")
     return redirect(url_for('wardrobe'))
 
+@app.route('/upload/status/<job_id>')
+@login_required
+@limiter.exempt
+def upload_status(job_id):
+    job = upload_queue.status(job_id)
+    if not job or job['wardrobe_id'] != session['user']['wardrobe_id']:
+        return jsonify({'error': 'Unknown upload job'}), 404
+    del job['wardrobe_id']
+    return jsonify(job)
+
 @app.route('/delete/<int:item_id>', methods=['POST'])
 @login_required
 def delete(item_id):
@@ -319,47 +504,49 @@ def delete(item_id):
 @app.route('/generate')
 @login_required
 def generate():
-    wardrobe = fetch_wardrobe_items(session['user']['wardrobe_id'])
-    outfits = generate_outfit_suggestions(wardrobe)
-    # for outfit in outfits:
-    #     log_outfit_to_elasticsearch(outfit, session.get('user'))
-    return render_template('outfits.html', outfits=outfits, closest_color_name= _closest_color_name)
+    page, limit = get_page_args()
+    user = session['user']
+    ensure_generated_outfits(user['wardrobe_id'])
+    page_info = PageInfo(page, limit)
+
+    def outfits():
+        # rendered as they are read; each one is queued for the background bulk logger (elk_logger.py)
+        for outfit in paged(iter_generated_outfits(user['wardrobe_id'], limit=limit + 1, offset=(page - 1) * limit),
+                            page_info):
+            log_outfit_to_elasticsearch(outfit, user)
+            yield outfit
+
+    return stream_page('outfits.html', outfits=outfits(), page_info=page_info, closest_color_name= _closest_color_name)
 
 @app.route('/generate-item/<int:item_id>', methods=['GET', 'POST'])
 @login_required
 def generate_item(item_id):
     
-    wardrobe = fetch_wardrobe_items(session['user']['wardrobe_id'])
-    user_input = {}
-    
-    for item_type, items in wardrobe.items():
-        for item in items:
-            if item['id'] == item_id:
-                user_input = {
-                                'id': item_id,
-                                'type': item_type,
-                                'rgb': item['rgb'],
-                                'image': item['image']
-                            }
-
-    outfits = suggest_outfit_for_item(user_input, wardrobe)
-    return render_template('outfits.html', outfits=outfits, closest_color_name= _closest_color_name, user_input=user_input)
+    page, limit = get_page_args()
+    wardrobe_id = session['user']['wardrobe_id']
+    user_input = fetch_wardrobe_items(wardrobe_id).by_id.get(item_id)
+    if not user_input:
+        abort(404)
+
+    ensure_generated_outfits(wardrobe_id)
+    page_info = PageInfo(page, limit)
+    outfits = paged(iter_generated_outfits(wardrobe_id, item_id=item_id, limit=limit + 1, offset=(page - 1) * limit),
+                    page_info)
+    return stream_page('outfits.html', outfits=outfits, page_info=page_info, closest_color_name= _closest_color_name,
+                       user_input=user_input)
 
 @app.route('/ootd')
 @login_required
 def ootd():
 
     user = User.from_dict(session['user'])
-    wardrobe = fetch_wardrobe_items(user.wardrobe_id)
-    outfits = generate_outfit_suggestions(wardrobe)
+    # Sampled once per wardrobe and day, then cached until midnight
+    selected_outfit = fetch_outfit_of_the_day(user.wardrobe_id, date.today())
 
-    if not outfits:
+    if not selected_outfit:
         flash("No saved outfits yet!", "warning")
         return redirect(url_for('wardrobe'))
 
-    # Pick one outfit per day based on the date
-    random.seed(date.today().isoformat())
-    selected_outfit = random.choice(outfits)
     return render_template('ootd.html', selected_outfit=selected_outfit)
 
 @app.route('/suggestions/<int:item_id>', methods=['GET', 'POST'])
@@ -367,49 +554,107 @@ def ootd():
 def suggestions(item_id):
     
     user = User.from_dict(session['user'])
-    user_input = {}
-    wardrobe = fetch_wardrobe_items(user.wardrobe_id)
-    for type, items in wardrobe.items():
-        for item in items:
-            if item['id'] == item_id:
-                rgb = item['rgb']
-                item_type = type
-                user_input = {
-                    item_type: rgb
-                }
+    item = fetch_clothing_item(user.wardrobe_id, item_id)
+    if not item:
+        abort(404)
+    user_input = {item['type']: item['rgb']}
     
-    suggestions = suggestions_for_item(user_input)
+    suggestions = suggestions_for_item(user_input, swatch_image=swatch_url)
     
     return render_template('suggestions.html', suggestions=suggestions, closest_color_name=_closest_color_name, user_input= user_input)
 
+SWATCH_MAX_AGE = 365 * 24 * 3600  # a color's swatch never changes
+
+def swatch_url(rgb):
+    r, g, b = rgb
+    return url_for('swatch', r=r, g=g, b=b)
+
+@app.route('/swatch/<int:r>/<int:g>/<int:b>.png')
+@limiter.exempt
+def swatch(r, g, b):
+    if max(r, g, b) > 255:
+        abort(404)
+    response = make_response(generate_color_box_png((r, g, b)))
+    response.mimetype = 'image/png'
+    response.cache_control.public = True
+    response.cache_control.max_age = SWATCH_MAX_AGE
+    response.cache_control.immutable = True
+    response.set_etag(f"{r:02x}{g:02x}{b:02x}")
+    return response.make_conditional(request)
+
 @app.route('/save_outfit', methods=['POST'])
 @login_required
 def save_outfit_route():
     
     try:
-        t = eval(request.form['top'])
-        p = eval(request.form['pants'])
-        s = eval(request.form['shoes'])
-        j = eval(request.form.get('jacket')) if request.form.get('jacket') else None
-        score = float(request.form['score'])
-    except:
+        top_id = int(request.form['top_id'])
+        pant_id = int(request.form['pant_id'])
+        shoe_id = int(request.form['shoe_id'])
+        jacket_id = int(request.form['jacket_id']) if request.form.get('jacket_id') else None
+    except (KeyError, ValueError):
         flash("Invalid outfit data", "danger")
         return redirect(url_for('generate'))
 
-    top_id = get_item_id_by_color(session['user']['wardrobe_id'], 'tops', t)
-    pants_id = get_item_id_by_color(session['user']['wardrobe_id'], 'pants', p)
-    shoes_id = get_item_id_by_color(session['user']['wardrobe_id'], 'shoes', s)
-    jacket_id = get_item_id_by_color(session['user']['wardrobe_id'], 'jackets', j) if j else None
-
-    save_outfit(session['user']['wardrobe_id'], top_id, pants_id, shoes_id, jacket_id, score)
-    flash("Outfit saved!", "success")
+    saved = save_outfit(session['user']['wardrobe_id'], top_id, pant_id, shoe_id, jacket_id)
+    if saved is None:
+        flash("Invalid outfit data", "danger")
+    elif saved:
+        flash("Outfit saved!", "success")
+    else:
+        flash("Outfit already saved!", "info")
     return redirect(url_for('generate'))
 
 @app.route('/saved')
 @login_required
 def saved():
-    outfits = fetch_saved_outfits(session['user']['wardrobe_id'])
-    return render_template('outfits.html', outfits=outfits, saved=True, closest_color_name= _closest_color_name)
+    # streamed straight from the database cursor, however many outfits are saved
+    outfits = iter_saved_outfits(session['user']['wardrobe_id'])
+    return stream_page('outfits.html', outfits=outfits, saved=True, closest_color_name= _closest_color_name)
+
+@app.cli.command('rebuild-outfits')
+@click.option('--wardrobe-id', type=int, default=None, help='Only rebuild this wardrobe.')
+def rebuild_outfits_command(wardrobe_id):
+    """Recompute the stored outfits of one or every wardrobe from scratch."""
+    for wid in [wardrobe_id] if wardrobe_id else fetch_all_wardrobe_ids():
+        count = rebuild_generated_outfits(wid)
+        click.echo(f"Wardrobe {wid}: {count} outfits")
+
+@app.cli.command('backfill-thumbnails')
+@click.option('--force', is_flag=True, help='Regenerate variants that are already recorded.')
+def backfill_thumbnails_command(force):
+    """Generate the sized variants of images that have none in THUMBNAIL_FORMAT yet."""
+    folder = app.config['UPLOAD_FOLDER']
+    written = []
+    for filename in fetch_images_without_thumbnails(None if force else THUMBNAIL_FORMAT):
+        try:
+            click.echo(f"{filename}: {', '.join(make_variants(folder, filename))}")
+            written.append(filename)
+        except Exception as e:
+            click.echo(f"{filename}: failed ({e})")
+    if written:
+        store_thumbnail_format(written, THUMBNAIL_FORMAT)
+
+@app.cli.command('backfill-color-features')
+def backfill_color_features_command():
+    """Store the colour features of items uploaded before they were computed at upload."""
+    click.echo(f"{backfill_color_features()} items updated")
+
+@app.cli.command('backfill-palettes')
+def backfill_palettes_command():
+    """Extract the colour palettes of items uploaded before palettes existed."""
+    palettes = {}
+    for item_id, filename in fetch_items_without_palette():
+        try:
+            with Image.open(os.path.join(app.config['UPLOAD_FOLDER'], filename)) as image:
+                palettes[item_id] = get_palette(image)
+        except Exception as e:
+            click.echo(f"{filename}: failed ({e})")
+    wardrobe_ids = store_palettes(palettes) if palettes else []
+    click.echo(f"{len(palettes)} palettes stored")
+    if OUTFIT_SCORING == 'palette':
+        # stored outfits were scored without these palettes
+        for wid in wardrobe_ids:
+            click.echo(f"Wardrobe {wid}: {rebuild_generated_outfits(wid)} outfits")
 
 @app.route('/logout')
 def logout():
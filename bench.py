@@ -0,0 +1,238 @@
+"""
+Benchmarks for the color and outfit engine in colors_test.py.
+
+    python bench.py                        # full suite, JSON results on stdout
+    python bench.py --quick -o run.json    # small wardrobes only, written to run.json
+    python bench.py --compare run.json     # also print the time ratio against an earlier run
+
+Every case is timed over several runs (best and median wall time), then run once
+more under tracemalloc for its peak Python memory. Wardrobes are synthetic and
+seeded, so two runs of the same commit measure the same work.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+from PIL import Image
+import colors_test
+from colors_test import (CLOTHING_TYPES, NEUTRAL_COLORS, _score_outfit, generate_outfit_suggestions,
+                         suggest_outfit_for_item, suggestions_for_item, _closest_color_name,
+                         _closest_color_name_cached, get_dominant_color, get_palette, PALETTE_SIZE)
+from thumbnails import is_variant
+
+SIZES = (5, 20, 50, 100, 200)   # items per category
+QUICK_SIZES = (5, 20, 50)
+ENGINES = ('numpy', 'python')
+PAGE = 48                       # outfits per page in the web app
+MAX_FULL_COMBINATIONS = 2_000_000    # larger wardrobes only get the paged generate case
+MAX_PYTHON_COMBINATIONS = 50_000     # the python engine is skipped above this
+UPLOADS_FOLDER = os.path.join('static', 'uploads')
+
+
+def synthetic_wardrobe(size, jackets=True, seed=0):
+    """size items per category, 40% of them wardrobe neutrals and the rest random colors."""
+    rng = random.Random(f"{seed}-{size}-{jackets}")
+    wardrobe = {t: [] for t in CLOTHING_TYPES}
+    item_id = 0
+    for clothing_type in CLOTHING_TYPES:
+        if clothing_type == 'jackets' and not jackets:
+            continue
+        for _ in range(size):
+            item_id += 1
+            if rng.random() < 0.4:
+                rgb = rng.choice(NEUTRAL_COLORS)
+            else:
+                rgb = tuple(rng.randrange(256) for _ in range(3))
+            wardrobe[clothing_type].append({
+                'id': item_id, 'type': clothing_type, 'rgb': rgb,
+                'image': f"{clothing_type}_{item_id}.png", 'color_name': None
+            })
+    return wardrobe
+
+
+def with_palettes(wardrobe, seed=0):
+    """Copy of wardrobe where every item has a palette of 1-PALETTE_SIZE colors, its own rgb the heaviest."""
+    rng = random.Random(f"palette-{seed}")
+    result = {}
+    for clothing_type, items in wardrobe.items():
+        result[clothing_type] = []
+        for item in items:
+            extra = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(rng.randrange(PALETTE_SIZE))]
+            weights = sorted((rng.random() for _ in extra), reverse=True)
+            total = 1 + sum(weights)
+            palette = [(item['rgb'], 1 / total)] + [(rgb, w / total) for rgb, w in zip(extra, weights)]
+            result[clothing_type].append(dict(item, palette=palette))
+    return result
+
+
+def combinations(wardrobe):
+    jacket_options = len(wardrobe['jackets']) + 1 if wardrobe['jackets'] else 1
+    return len(wardrobe['tops']) * len(wardrobe['pants']) * len(wardrobe['shoes']) * jacket_options
+
+
+def sample_images(folder=UPLOADS_FOLDER, limit=10):
+    # clothing uploads only (named <category>_<user>_…), not logos or profile pictures
+    names = sorted(f for f in os.listdir(folder)
+                   if f.lower().endswith(('.png', '.jpg', '.jpeg')) and f.startswith(CLOTHING_TYPES)
+                   and not is_variant(f))
+    return [os.path.join(folder, f) for f in names[:limit]]
+
+
+def measure(fn, repeat, max_seconds=2.0):
+    """Best/median seconds over up to `repeat` runs (fewer once max_seconds is spent), then peak memory."""
+    times = []
+    started = time.perf_counter()
+    while len(times) < repeat and (not times or time.perf_counter() - started < max_seconds):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'runs': len(times),
+        'best_s': min(times),
+        'median_s': statistics.median(times),
+        'peak_kib': round(peak / 1024, 1)
+    }
+
+
+def cases(sizes, engines, images):
+    """Yields (name, params, fn) for every benchmark."""
+    rng = random.Random(1)
+    colors = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(4000)]
+    for n in (3, 4):
+        groups = [colors[i:i + n] for i in range(0, 1000 * n, n)]
+        yield '_score_outfit', {'colors': n, 'calls': len(groups)}, lambda g=groups: [_score_outfit(*c) for c in g]
+
+    for jackets in (False, True):
+        for size in sizes:
+            wardrobe = synthetic_wardrobe(size, jackets)
+            combos = combinations(wardrobe)
+            item = wardrobe['tops'][0]
+            for engine in engines:
+                if engine == 'python' and combos > MAX_PYTHON_COMBINATIONS:
+                    continue
+                params = {'engine': engine, 'size': size, 'jackets': jackets, 'combinations': combos}
+                if combos <= MAX_FULL_COMBINATIONS:
+                    yield ('generate_outfit_suggestions', dict(params, limit=None),
+                           lambda w=wardrobe, e=engine: generate_outfit_suggestions(w, engine=e))
+                yield ('generate_outfit_suggestions', dict(params, limit=PAGE),
+                       lambda w=wardrobe, e=engine: generate_outfit_suggestions(w, engine=e, limit=PAGE))
+                yield ('suggest_outfit_for_item', dict(params, limit=None),
+                       lambda w=wardrobe, i=item, e=engine: suggest_outfit_for_item(i, w, engine=e))
+
+            # palette scoring, numpy only: every item has up to PALETTE_SIZE colors
+            if 'numpy' in engines:
+                palettes = with_palettes(wardrobe, size)
+                params = {'engine': 'numpy', 'scoring': 'palette', 'size': size, 'jackets': jackets,
+                          'combinations': combos}
+                if combos <= MAX_FULL_COMBINATIONS:
+                    yield ('generate_outfit_suggestions', dict(params, limit=None),
+                           lambda w=palettes: generate_outfit_suggestions(w, engine='numpy', scoring='palette'))
+                yield ('generate_outfit_suggestions', dict(params, limit=PAGE),
+                       lambda w=palettes: generate_outfit_suggestions(w, engine='numpy', scoring='palette', limit=PAGE))
+
+    for clothing_type in CLOTHING_TYPES:
+        yield ('suggestions_for_item', {'type': clothing_type},
+               lambda t=clothing_type: suggestions_for_item({t: (70, 130, 180)}))
+
+    def closest_names(cold):
+        if cold:
+            _closest_color_name_cached.cache_clear()
+        return [_closest_color_name(c) for c in colors]
+    yield '_closest_color_name', {'calls': len(colors), 'cache': 'cold'}, lambda: closest_names(True)
+    yield '_closest_color_name', {'calls': len(colors), 'cache': 'warm'}, lambda: closest_names(False)
+
+    for path in images:
+        with Image.open(path) as image:
+            width, height = image.size
+
+        def dominant(p=path):
+            with Image.open(p) as image:
+                return get_dominant_color(image)
+        yield 'get_dominant_color', {'image': os.path.basename(path), 'pixels': width * height}, dominant
+
+        def palette(p=path):
+            with Image.open(p) as image:
+                return get_palette(image)
+        yield 'get_palette', {'image': os.path.basename(path), 'pixels': width * height}, palette
+
+
+def case_key(result):
+    return result['case'], json.dumps(result['params'], sort_keys=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the color and outfit engine.")
+    parser.add_argument('--quick', action='store_true', help=f"only wardrobes of {QUICK_SIZES} items per category")
+    parser.add_argument('--sizes', type=int, nargs='+', help="items per category, overrides --quick")
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=list(ENGINES))
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per case")
+    parser.add_argument('--filter', help="only cases whose name contains this")
+    parser.add_argument('--images', type=int, default=10, help=f"sample images from {UPLOADS_FOLDER}")
+    parser.add_argument('-o', '--output', help="write the JSON results here instead of stdout")
+    parser.add_argument('--compare', help="earlier JSON results to print time ratios against")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    images = sample_images(limit=args.images) if os.path.isdir(UPLOADS_FOLDER) else []
+
+    results = []
+    for name, params, fn in cases(sizes, args.engines, images):
+        if args.filter and args.filter not in name:
+            continue
+        result = {'case': name, 'params': params, **measure(fn, args.repeat)}
+        results.append(result)
+        print(f"{name:30} {json.dumps(params):90} {result['best_s'] * 1000:10.2f} ms"
+              f" {result['peak_kib']:10.1f} KiB", file=sys.stderr)
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'outfit_engine_default': colors_test.OUTFIT_ENGINE,
+        'results': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            before = {case_key(r): r for r in json.load(f)['results']}
+        print(f"\nCompared with {args.compare} (best time, new / old):", file=sys.stderr)
+        for result in results:
+            old = before.get(case_key(result))
+            if old:
+                print(f"{result['case']:30} {json.dumps(result['params']):90}"
+                      f" {result['best_s'] / old['best_s']:6.2f}x", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from colors_test import CLOTHING_TYPES, ___color_distance
+
+_color_distance = ___color_distance  # a double-underscore name would be mangled inside the class
+
+
+class ColorIndex:
+    """
+    KD-tree over the colors of a wardrobe's items (one per category plus one over
+    everything), for "what else do I own that is close to this navy?".
+    Distances are ___color_distance, the RGB distance behind the scoring thresholds.
+    """
+
+    def __init__(self, wardrobe):
+        self.items = {t: list(wardrobe.get(t, [])) for t in CLOTHING_TYPES}
+        self.items[None] = [it for t in CLOTHING_TYPES for it in self.items[t]]
+        self._trees = {
+            key: cKDTree(np.array([it['rgb'] for it in items], dtype=np.float64))
+            for key, items in self.items.items() if items
+        }
+
+    def nearest(self, rgb, limit=10, clothing_type=None, exclude_id=None):
+        """Up to limit (distance, item) pairs, closest first, optionally of one category only."""
+        tree = self._trees.get(clothing_type)
+        if tree is None or limit <= 0:
+            return []
+        items = self.items[clothing_type]
+        # one extra neighbour in case the excluded item (the query item itself) is among them
+        k = min(limit + (exclude_id is not None), len(items))
+        _, indexes = tree.query(np.array(rgb, dtype=np.float64), k=[*range(1, k + 1)])
+        found = [items[i] for i in indexes if i < len(items) and items[i]['id'] != exclude_id]
+        # exact ___color_distance, ties by id so the order is stable
+        matches = sorted(((_color_distance(rgb, it['rgb']), it) for it in found), key=lambda m: (m[0], m[1]['id']))
+        return matches[:limit]
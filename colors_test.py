@@ -1,13 +1,44 @@
 import colorsys
+import os
 import webcolors
-from itertools import product, combinations
-from collections import Counter
+from itertools import product, combinations, chain
+from collections import namedtuple
+from functools import lru_cache
 import base64
+import heapq
 from io import BytesIO
 from PIL import Image
+import numpy as np
+import time
+from metrics import Counter, Histogram
 
 MIN_ACCEPTABLE_SCORE = 2.5
 
+# Outfit engine used by generate_outfit_suggestions: "numpy" (vectorized) or "python" (reference loop)
+OUTFIT_ENGINE = os.getenv('OUTFIT_ENGINE', 'numpy')
+# What a pair of items is scored on: "dominant" (each item's single color) or
+# "palette" (every color of both palettes, weighted, see get_palette)
+OUTFIT_SCORING = os.getenv('OUTFIT_SCORING', 'dominant')
+
+PALETTE_SIZE = 5            # colors kept per item
+PALETTE_MIN_WEIGHT = 0.05   # smaller clusters (stray pixels, shadows) are dropped
+PALETTE_MERGE_DISTANCE = 24 # closer clusters count as one color
+PALETTE_SHARES = 10         # palette scoring weighs colors in whole tenths, see _palette_shares
+
+# Engine metrics, labelled by engine and by function ("generate" or "suggest")
+OUTFIT_COMBINATIONS = Counter('outfit_combinations_evaluated_total', 'Outfit combinations scored', ('engine', 'function'))
+OUTFITS_KEPT = Counter('outfit_combinations_kept_total', 'Combinations scoring above MIN_ACCEPTABLE_SCORE', ('engine', 'function'))
+OUTFIT_SCORING_SECONDS = Histogram('outfit_scoring_seconds', 'Time spent producing outfit suggestions', ('engine', 'function'))
+
+CLOTHING_TYPES = ('tops', 'pants', 'shoes', 'jackets')
+# Category pairs in the order _score_outfit compares an outfit's colors
+CATEGORY_PAIRS = list(combinations(CLOTHING_TYPES, 2))
+
+NEUTRAL_COLORS = [
+    (255, 255, 255), (0, 0, 0), (128, 128, 128), (192, 192, 192),
+    (160, 82, 45), (245, 245, 220)
+]
+
 # Color conversion
 def ___rgb_to_hsv(rgb):
     return colorsys.rgb_to_hsv(*[x / 255.0 for x in rgb])
@@ -37,69 +68,376 @@ def __is_analogous(c1, c2, threshold=50):
     return h_diff < 30 and ___color_distance(c1, c2) < threshold
 
 def __is_neutral(c1, c2, threshold=50):
-    neutrals = [
-        (255, 255, 255), (0, 0, 0), (128, 128, 128), (192, 192, 192),
-        (160, 82, 45), (245, 245, 220)
-    ]
-    for neutral in neutrals:
+    for neutral in NEUTRAL_COLORS:
         if ___color_distance(c1, neutral) < threshold or ___color_distance(c2, neutral) < threshold:
             return True
     return False
 
-# Outfit scoring
-def _score_outfit(*colors):
-    total_score = 0
-    comparisons = 0
-
-    for c1, c2 in combinations(colors, 2):
-        comparisons += 1
-        if __is_complementary(c1, c2):
-            total_score += 3  # Strong match
-        elif __is_analogous(c1, c2):
-            total_score += 2  # Good match
-        elif __is_neutral(c1, c2):
-            total_score += 1  # Acceptable match
-        else:
-            total_score += 0  # No match
+def _rgb_to_lab(rgb):
+    # sRGB (D65 white) -> CIELAB
+    def linear(c):
+        c = c / 255.0
+        return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+    def f(t):
+        return t ** (1 / 3) if t > 216 / 24389 else (24389 / 27 * t + 16) / 116
 
+    r, g, b = (linear(c) for c in rgb)
+    x = f((0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.95047)
+    y = f(0.2126 * r + 0.7152 * g + 0.0722 * b)
+    z = f((0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.08883)
+    return (116 * y - 16, 500 * (x - y), 200 * (y - z))
+
+# Per-item color features
+def color_features(rgb, threshold=50):
+    """
+    Everything scoring derives from a single color, so it can be computed once per
+    item and stored (see db.insert_clothing_item) instead of once per pair:
+    {'hsv', 'complementary', 'neutral' (within threshold of a NEUTRAL_COLORS entry),
+     'neutral_distance', 'lab'}
+    """
+    neutral_distance = min(___color_distance(rgb, n) for n in NEUTRAL_COLORS)
+    return {
+        'hsv': ___rgb_to_hsv(rgb),
+        'complementary': __get_complementary_color(rgb),
+        'neutral': neutral_distance < threshold,
+        'neutral_distance': neutral_distance,
+        'lab': _rgb_to_lab(rgb)
+    }
+
+def _item_features(item):
+    # items loaded before the features were backfilled carry None
+    return item.get('features') or color_features(item['rgb'])
+
+def _pair_score(c1, f1, c2, f2, threshold=50):
+    # same decisions as __is_complementary / __is_analogous / __is_neutral
+    if ___color_distance(f1['complementary'], c2) < threshold:
+        return 3  # Strong match
+    h_diff = abs(f1['hsv'][0] - f2['hsv'][0])
+    if min(h_diff, 1 - h_diff) * 360 < 30 and ___color_distance(c1, c2) < threshold:
+        return 2  # Good match
+    if f1['neutral'] or f2['neutral']:
+        return 1  # Acceptable match
+    return 0  # No match
+
+def _palette_shares(item):
+    """
+    The item's palette as [(rgb, share), …] with whole shares summing to
+    PALETTE_SHARES (largest remainders round up), so palette scores stay integers
+    in both engines. Items without a palette count as their single color.
+    """
+    palette = item.get('palette')
+    if not palette:
+        return [(tuple(item['rgb']), PALETTE_SHARES)]
+    total = sum(weight for _, weight in palette)
+    exact = [weight / total * PALETTE_SHARES for _, weight in palette]
+    shares = [int(x) for x in exact]
+    for i in sorted(range(len(exact)), key=lambda i: shares[i] - exact[i])[:PALETTE_SHARES - sum(shares)]:
+        shares[i] += 1
+    return [(tuple(rgb), share) for (rgb, _), share in zip(palette, shares) if share]
+
+def _palette_pair_score(a, b):
+    # 0..3 * PALETTE_SHARES ** 2: every color pair of the two palettes, weighted by both shares
+    return sum(share_a * share_b * _pair_score(c1, color_features(c1), c2, color_features(c2))
+               for c1, share_a in _palette_shares(a) for c2, share_b in _palette_shares(b))
+
+# Outfit scoring
+def _score_items(*items, scoring='dominant'):
+    """_score_outfit for wardrobe items ({'rgb', 'features'?, 'palette'?}), reusing their stored features."""
+    comparisons = len(items) * (len(items) - 1) // 2
     if comparisons == 0:
         return 0
+    if scoring == 'palette':
+        total_score = sum(_palette_pair_score(a, b) for a, b in combinations(items, 2))
+        return _normalize_score(total_score / PALETTE_SHARES ** 2, comparisons)
+    colors = [(it['rgb'], _item_features(it)) for it in items]
+    total_score = sum(_pair_score(c1, f1, c2, f2) for (c1, f1), (c2, f2) in combinations(colors, 2))
+    return _normalize_score(total_score, comparisons)
+
+def _score_outfit(*colors):
+    return _score_items(*({'rgb': c} for c in colors))
 
+def _normalize_score(total_score, comparisons):
     # Normalize to a score out of 5
     max_possible_score = comparisons * 3  # 3 is the highest score per pair
     normalized_score = (total_score / max_possible_score) * 5
     return round(normalized_score, 2)
 
+# Vectorized scoring
+# Per-item features come from color_features (stored or computed) so every
+# threshold decision matches _score_outfit exactly; only the pairwise work is broadcast.
+_ColorArrays = namedtuple('_ColorArrays', ['rgb', 'hue', 'complementary', 'neutral'])
+
+def _item_color_arrays(items):
+    features = [_item_features(it) for it in items]
+    rgb = np.array([it['rgb'] for it in items], dtype=np.uint8).reshape(-1, 3)
+    hue = np.array([f['hsv'][0] for f in features], dtype=np.float64)
+    complementary = np.array([f['complementary'] for f in features], dtype=np.uint8).reshape(-1, 3)
+    neutral = np.array([f['neutral'] for f in features], dtype=bool)
+    return _ColorArrays(rgb, hue, complementary, neutral)
+
+def _squared_distances(a, b):
+    diff = a[:, None, :].astype(np.int32) - b[None, :, :].astype(np.int32)
+    return (diff * diff).sum(axis=2)
+
+def _pair_score_matrix(a, b, threshold=50):
+    """
+    a, b: _ColorArrays for the first and second item of each pair
+    Returns an int8 (len(a), len(b)) matrix holding the 3/2/1/0 score
+    _score_outfit gives the pair (a[i], b[j]).
+    """
+    limit = threshold ** 2
+    complementary = _squared_distances(a.complementary, b.rgb) < limit
+    h_diff = np.abs(a.hue[:, None] - b.hue[None, :])
+    h_diff = np.minimum(h_diff, 1 - h_diff) * 360
+    analogous = (h_diff < 30) & (_squared_distances(a.rgb, b.rgb) < limit)
+    neutral = a.neutral[:, None] | b.neutral[None, :]
+    return np.select([complementary, analogous, neutral], [3, 2, 1], 0).astype(np.int8)
+
+def _wardrobe_pair_matrices(wardrobe):
+    """Pair score matrix for every category pair, rows/columns in wardrobe list order."""
+    features = {t: _item_color_arrays(wardrobe.get(t, [])) for t in CLOTHING_TYPES}
+    return {(a, b): _pair_score_matrix(features[a], features[b]) for a, b in CATEGORY_PAIRS}
+
+def _palette_arrays(items):
+    # every palette color of items, their shares, and where each item's colors start
+    colors, shares, starts = [], [], []
+    for it in items:
+        starts.append(len(colors))
+        if it.get('palette'):
+            for rgb, share in _palette_shares(it):
+                colors.append({'rgb': rgb})
+                shares.append(share)
+        else:
+            colors.append(it)  # single color, with its stored features
+            shares.append(PALETTE_SHARES)
+    return _item_color_arrays(colors), np.array(shares, dtype=np.int16), np.array(starts, dtype=np.intp)
+
+def _palette_pair_matrices(wardrobe):
+    """
+    _wardrobe_pair_matrices for palette scoring: entry (i, j) is _palette_pair_score
+    of the two items (int16, 0..3 * PALETTE_SHARES ** 2). Scored over all palette
+    colors at once, then summed per item with reduceat.
+    """
+    arrays = {t: _palette_arrays(wardrobe.get(t, [])) for t in CLOTHING_TYPES}
+    pairs = {}
+    for a, b in CATEGORY_PAIRS:
+        (colors_a, shares_a, starts_a), (colors_b, shares_b, starts_b) = arrays[a], arrays[b]
+        if not (len(starts_a) and len(starts_b)):
+            pairs[a, b] = np.zeros((len(starts_a), len(starts_b)), dtype=np.int16)
+            continue
+        weighted = _pair_score_matrix(colors_a, colors_b).astype(np.int16) * shares_a[:, None] * shares_b[None, :]
+        pairs[a, b] = np.add.reduceat(np.add.reduceat(weighted, starts_a, axis=0), starts_b, axis=1)
+    return pairs
+
+def _pair_matrices(wardrobe, pair_scores=None, scoring='dominant'):
+    if scoring == 'palette':
+        return _palette_pair_matrices(wardrobe)
+    # Prefer the cached per-wardrobe matrix (see pair_scores.py), fall back to computing
+    if pair_scores is not None:
+        pairs = pair_scores.lookup(wardrobe)
+        if pairs is not None:
+            return pairs
+    return _wardrobe_pair_matrices(wardrobe)
+
+def _base_totals(pairs):
+    # pair totals for top/pants/shoes, shape (tops, pants, shoes)
+    return (pairs['tops', 'pants'][:, :, None].astype(np.int16)
+            + pairs['tops', 'shoes'][:, None, :]
+            + pairs['pants', 'shoes'][None, :, :])
+
+def _jacket_totals(pairs):
+    # pants/shoes against jacket pair totals, shape (pants, shoes, jackets)
+    return (pairs['pants', 'jackets'][:, None, :].astype(np.int16)
+            + pairs['shoes', 'jackets'][None, :, :])
+
+def _top_k_order(scores, k=None):
+    """
+    Indices of the k best scores in the order a stable descending sort gives,
+    without sorting everything when k is small. k=None sorts all scores.
+    """
+    if k is None or k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    if k <= 0:
+        return np.array([], dtype=np.intp)
+    kth = np.partition(scores, len(scores) - k)[len(scores) - k]  # k-th best score
+    above = np.flatnonzero(scores > kth)
+    ties = np.flatnonzero(scores == kth)[:k - len(above)]
+    chosen = np.sort(np.concatenate([above, ties]))
+    return chosen[np.argsort(-scores[chosen], kind='stable')]
+
+def _sorted_page(outfits, limit=None, offset=0):
+    # Same as sorting every outfit by score and slicing, but with limit set only
+    # offset + limit outfits are held at once (heapq.nsmallest is stable)
+    if limit is None:
+        return sorted(outfits, key=lambda o: o['score'], reverse=True)[offset:]
+    return heapq.nsmallest(offset + limit, outfits, key=lambda o: -o['score'])[offset:]
+
+# Normalized score for every possible pair total, indexed by total (3 or 6 comparisons)
+_SCORE_TABLES = {
+    comparisons: np.array([_normalize_score(t, comparisons) for t in range(comparisons * 3 + 1)])
+    for comparisons in (3, 6)
+}
+# Same for palette scoring, whose totals are in 1 / PALETTE_SHARES ** 2 points
+_PALETTE_SCORE_TABLES = {
+    comparisons: np.array([_normalize_score(t / PALETTE_SHARES ** 2, comparisons)
+                           for t in range(comparisons * 3 * PALETTE_SHARES ** 2 + 1)])
+    for comparisons in (3, 6)
+}
+
+def _score_tables(scoring):
+    if scoring not in ('dominant', 'palette'):
+        raise ValueError(f"Unknown outfit scoring: {scoring}")
+    return _PALETTE_SCORE_TABLES if scoring == 'palette' else _SCORE_TABLES
+
 # Closest color name using webcolors
-def _closest_color_name(rgb):
+COLOR_NAME_CACHE_SIZE = int(os.getenv('COLOR_NAME_CACHE_SIZE', 4096))
+
+def _build_color_name_index(cell=16):
+    """
+    Splits the RGB cube into cells of cell^3 colors and keeps, per cell, only the
+    CSS3 names that can be the nearest name of some color inside it: a name is
+    dropped when even its closest point in the cell is farther than the worst case
+    of another name. Lookups then compare a few candidates instead of every name.
+    """
+    names = list(webcolors.names(spec="css3"))
+    name_rgb = np.array([tuple(webcolors.name_to_rgb(n, spec="css3")) for n in names], dtype=np.int64)
+
+    lo = np.arange(0, 256, cell)[:, None]
+    hi = lo + cell - 1
+    # per channel squared distance from each cell interval to each name, shape (cells, names, 3)
+    below = np.clip(lo[:, :, None] - name_rgb[None, :, :], 0, None)
+    above = np.clip(name_rgb[None, :, :] - hi[:, :, None], 0, None)
+    near = (below + above) ** 2
+    far = np.maximum(name_rgb[None, :, :] - lo[:, :, None], hi[:, :, None] - name_rgb[None, :, :]) ** 2
+
+    def per_cell(d):
+        return d[:, None, None, :, 0] + d[None, :, None, :, 1] + d[None, None, :, :, 2]
+
+    near, far = per_cell(near), per_cell(far)
+    candidates = (near <= far.min(axis=3, keepdims=True)).reshape(-1, len(names))
+    # cell i's candidates are cell_names[offsets[i]:offsets[i + 1]]: two flat arrays rather
+    # than thousands of small ones, so preforked workers share them without copying pages
+    cell_names = np.flatnonzero(candidates) % len(names)
+    offsets = np.concatenate([[0], np.cumsum(candidates.sum(axis=1))])
+    return [n.title() for n in names], name_rgb, offsets, cell_names, cell
+
+_COLOR_NAME_INDEX = _build_color_name_index()
+
+def _nearest_color_name(rgb):
+    titles, name_rgb, offsets, cell_names, cell = _COLOR_NAME_INDEX
+    n = 256 // cell
+    r, g, b = (int(c) // cell for c in rgb)
+    index = (r * n + g) * n + b
+    candidates = cell_names[offsets[index]:offsets[index + 1]]
+    diff = name_rgb[candidates] - np.array(rgb, dtype=np.int64)
+    # candidates are in webcolors order and argmin keeps the first minimum,
+    # so ties resolve like the original linear scan
+    return titles[candidates[np.argmin((diff * diff).sum(axis=1))]]
+
+@lru_cache(maxsize=COLOR_NAME_CACHE_SIZE)
+def _closest_color_name_cached(rgb):
     try:
         return webcolors.rgb_to_name(rgb).title()
     except ValueError:
-        min_distance = float('inf')
-        closest_name = None
-        for name in webcolors.names(spec="css3"):
-            r, g, b = webcolors.name_to_rgb(name, spec="css3")
-            dist = ___color_distance(rgb, (r, g, b))
-            if dist < min_distance:
-                min_distance = dist
-                closest_name = name.title()
-        return closest_name
+        return _nearest_color_name(rgb)
 
-def generate_color_box_base64(rgb, size=(200, 200)):
+def _closest_color_name(rgb):
+    return _closest_color_name_cached(tuple(rgb))
+
+SWATCH_CACHE_SIZE = int(os.getenv('SWATCH_CACHE_SIZE', 2048))
+
+@lru_cache(maxsize=SWATCH_CACHE_SIZE)
+def generate_color_box_png(rgb, size=(200, 200)):
+    # Encoded PNG bytes of a solid color box; rgb and size must be tuples
     img = Image.new('RGB', size, rgb)
     buffer = BytesIO()
     img.save(buffer, format='PNG')
-    base64_img = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    return buffer.getvalue()
+
+def generate_color_box_base64(rgb, size=(200, 200)):
+    base64_img = base64.b64encode(generate_color_box_png(tuple(rgb), tuple(size))).decode('utf-8')
     return f"data:image/png;base64,{base64_img}"
 
-def get_dominant_color(image, resize_to=(100, 100)):
-    small_img = image.resize(resize_to)
-    pixels = list(small_img.getdata())
-    color_counts = Counter(pixels)
-    return color_counts.most_common(1)[0][0]
+def get_dominant_color(image, resize_to=(100, 100), bits=5, border=0.0):
+    """
+    Most common color of the image with each channel quantized to `bits` bits
+    (8 = exact colors), returned as the mean RGB of the pixels in the winning bin
+    so photo noise does not split one color into many near-duplicates.
+    border: fraction of the width/height to ignore on each side, e.g. 0.1 to skip
+            background around a centered garment. Must be in [0, 0.5).
+    """
+    if not 0 <= border < 0.5:
+        raise ValueError(f"border must be in [0, 0.5), got {border}")
+    # JPEGs that are not decoded yet are decoded at a reduced scale; no-op otherwise
+    image.draft('RGB', resize_to)
+    small_img = image.convert('RGB').resize(resize_to, reducing_gap=3.0)
+    pixels = np.asarray(small_img, dtype=np.uint8)
+    if border:
+        dy, dx = int(pixels.shape[0] * border), int(pixels.shape[1] * border)
+        pixels = pixels[dy:pixels.shape[0] - dy, dx:pixels.shape[1] - dx]
+    pixels = pixels.reshape(-1, 3)
+
+    q = (pixels >> (8 - bits)).astype(np.int32)
+    bins = (q[:, 0] << (2 * bits)) | (q[:, 1] << bits) | q[:, 2]
+    winner = np.bincount(bins, minlength=1 << (3 * bits)).argmax()
+    centroid = pixels[bins == winner].mean(axis=0)
+    return tuple(int(c) for c in np.rint(centroid))
+
+def get_palette(image, k=PALETTE_SIZE, resize_to=(64, 64), iterations=10, min_weight=PALETTE_MIN_WEIGHT,
+                merge_distance=PALETTE_MERGE_DISTANCE):
+    """
+    Up to k main colors of the image as [(rgb, weight), …], heaviest first, with
+    weights (share of pixels) summing to 1. Vectorized k-means over the downscaled
+    pixels, seeded from the busiest 4-bit color bins so the result is deterministic.
+    Clusters within merge_distance of a heavier one are merged into it, and
+    clusters under min_weight are dropped.
+    """
+    image.draft('RGB', resize_to)
+    # nearest-neighbour sampling: averaging filters would invent colors where stripes meet
+    small_img = image.convert('RGB').resize(resize_to, Image.Resampling.NEAREST)
+    pixels = np.asarray(small_img, dtype=np.float32).reshape(-1, 3)
+
+    # seeds: greedy k-means++ without randomness, over the bins' mean colors
+    q = pixels.astype(np.int32) >> 4
+    bins = (q[:, 0] << 8) | (q[:, 1] << 4) | q[:, 2]
+    counts = np.bincount(bins, minlength=1 << 12)
+    used = np.flatnonzero(counts)
+    means = np.stack([np.bincount(bins, weights=pixels[:, c], minlength=1 << 12)[used] for c in range(3)], axis=1)
+    means /= counts[used, None]
+    centers = [means[counts[used].argmax()]]
+    for _ in range(min(k, len(used)) - 1):
+        nearest = ((means[:, None, :] - np.array(centers)[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+        centers.append(means[(counts[used] * nearest).argmax()])
+    centers = np.array(centers)
+
+    for _ in range(iterations):
+        labels = ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        sizes = np.bincount(labels, minlength=len(centers))
+        sums = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=len(centers)) for c in range(3)], axis=1)
+        moved = np.where(sizes[:, None] > 0, sums / np.maximum(sizes, 1)[:, None], centers)
+        if np.allclose(moved, centers, atol=0.5):
+            break
+        centers = moved
+
+    # clusters closer than merge_distance are one color split by shading; the heavier absorbs the lighter
+    palette = []  # [center, weight]
+    for i in np.argsort(-sizes, kind='stable'):
+        for entry in palette:
+            if ((entry[0] - centers[i]) ** 2).sum() < merge_distance ** 2:
+                entry[0] = (entry[0] * entry[1] + centers[i] * sizes[i]) / (entry[1] + sizes[i])
+                entry[1] += sizes[i]
+                break
+        else:
+            palette.append([centers[i], sizes[i]])
+
+    palette = [(center, size / len(pixels)) for center, size in palette if size / len(pixels) >= min_weight]
+    palette.sort(key=lambda entry: -entry[1])
+    total = sum(weight for _, weight in palette)
+    return [(tuple(int(c) for c in np.rint(center)), round(float(weight / total), 4)) for center, weight in palette]
 
 # Generate combinations and print
-def generate_outfit_suggestions(wardrobe):
+def generate_outfit_suggestions(wardrobe, engine=None, pair_scores=None, limit=None, offset=0, scoring=None):
     """
     wardrobe: {
       'tops':    [ { 'rgb':(...), 'image':... }, … ],
@@ -117,43 +455,166 @@ def generate_outfit_suggestions(wardrobe):
       },
       …
     ]
+    engine: "numpy" or "python", defaults to OUTFIT_ENGINE. Both return the same
+            outfits, scores and ordering.
+    pair_scores: optional PairScoreMatrix for this wardrobe; the numpy engine then
+                 only looks pair scores up instead of computing them (dominant scoring only).
+    limit, offset: return only outfits [offset, offset + limit) of the sorted
+                   result; memory and sort cost then depend on offset + limit
+                   instead of the number of combinations.
+    scoring: "dominant" or "palette" (items' 'palette' lists), defaults to OUTFIT_SCORING.
     """
+    engine = engine or OUTFIT_ENGINE
+    scoring = scoring or OUTFIT_SCORING
+    started = time.perf_counter()
+    if engine == 'numpy':
+        outfits = _generate_outfit_suggestions_numpy(wardrobe, pair_scores, limit, offset, scoring)
+    elif engine == 'python':
+        outfits = _sorted_page(_iter_outfit_suggestions_python(wardrobe, scoring), limit, offset)
+    else:
+        raise ValueError(f"Unknown outfit engine: {engine}")
+    OUTFIT_SCORING_SECONDS.observe(time.perf_counter() - started, engine, 'generate')
+    return outfits
+
+def _iter_outfit_suggestions_python(wardrobe, scoring='dominant'):
+    # Passing outfits in itertools.product order, unsorted
     jackets = wardrobe.get("jackets", [])
-    
-    outfits = []
 
-    def build_and_append(top_item, pant_item, shoe_item, jacket_item):
-        # pull out the rgb tuples for scoring
-        colors = [top_item['rgb'], pant_item['rgb'], shoe_item['rgb']]
+    def build(top_item, pant_item, shoe_item, jacket_item):
+        items = [top_item, pant_item, shoe_item]
         if jacket_item:
-            colors.append(jacket_item['rgb'])
-        score = _score_outfit(*colors)
+            items.append(jacket_item)
+        score = _score_items(*items, scoring=scoring)
         if score > MIN_ACCEPTABLE_SCORE:
-            outfits.append({
+            return {
                 'top':    top_item,
                 'pants':  pant_item,
                 'shoes':  shoe_item,
                 'jacket': jacket_item,
                 'score':  score
-            })
+            }
 
+    combos = product(wardrobe['tops'], wardrobe['pants'], wardrobe['shoes'], [None])
     if jackets:
-        # with jacket
-        for top_it, pant_it, shoe_it, jacket_it in product(wardrobe['tops'], wardrobe['pants'], wardrobe['shoes'], wardrobe['jackets']):
-            build_and_append(top_it, pant_it, shoe_it, jacket_it)
-        # without jacket
-        for top_it, pant_it, shoe_it in product(wardrobe['tops'], wardrobe['pants'], wardrobe['shoes']):
-            build_and_append(top_it, pant_it, shoe_it, None)
-    else:
-        # only without jacket
-        for top_it, pant_it, shoe_it in product(wardrobe['tops'], wardrobe['pants'], wardrobe['shoes']):
-            build_and_append(top_it, pant_it, shoe_it, None)
+        # with jacket first, then without
+        combos = chain(product(wardrobe['tops'], wardrobe['pants'], wardrobe['shoes'], jackets), combos)
+
+    evaluated = kept = 0
+    for top_it, pant_it, shoe_it, jacket_it in combos:
+        evaluated += 1
+        outfit = build(top_it, pant_it, shoe_it, jacket_it)
+        if outfit:
+            kept += 1
+            yield outfit
+    OUTFIT_COMBINATIONS.inc('python', 'generate', amount=evaluated)
+    OUTFITS_KEPT.inc('python', 'generate', amount=kept)
+
+def _generate_outfit_suggestions_numpy(wardrobe, pair_scores=None, limit=None, offset=0, scoring='dominant'):
+    tops, pants, shoes = wardrobe['tops'], wardrobe['pants'], wardrobe['shoes']
+    jackets = wardrobe.get('jackets', [])
+    tables = _score_tables(scoring)
+    if not (tops and pants and shoes):
+        return []
+
+    pairs = _pair_matrices(wardrobe, pair_scores, scoring)
+    base = _base_totals(pairs)
+
+    k = None if limit is None else offset + limit
+
+    # Collect passing combinations in itertools.product order: all jacket
+    # combinations first, then the jacket-less ones, exactly like the loop version.
+    combos, scores = [], []
+    kept = 0
+
+    def keep_best():
+        # with a limit, only the k best so far survive each block (still in product order)
+        if k is not None and len(combos) > 1:
+            all_combos, all_scores = np.concatenate(combos), np.concatenate(scores)
+            best = np.sort(_top_k_order(all_scores, k))
+            combos[:] = [all_combos[best]]
+            scores[:] = [all_scores[best]]
+    if jackets:
+        jacket_pairs = _jacket_totals(pairs)
+        tj = pairs['tops', 'jackets']
+        shape = (len(pants), len(shoes), len(jackets))
+        # one top at a time keeps the 4-D block bounded for large wardrobes
+        for ti in range(len(tops)):
+            totals = base[ti][:, :, None] + tj[ti][None, None, :] + jacket_pairs
+            block = tables[6][totals.ravel()]
+            keep = np.flatnonzero(block > MIN_ACCEPTABLE_SCORE)
+            kept += len(keep)
+            pi, si, ji = np.unravel_index(keep, shape)
+            combos.append(np.column_stack([np.full(len(keep), ti), pi, si, ji]))
+            scores.append(block[keep])
+            keep_best()
+
+    block = tables[3][base.ravel()]
+    keep = np.flatnonzero(block > MIN_ACCEPTABLE_SCORE)
+    kept += len(keep)
+    OUTFIT_COMBINATIONS.inc('numpy', 'generate', amount=base.size * (len(jackets) + 1))
+    OUTFITS_KEPT.inc('numpy', 'generate', amount=kept)
+    ti, pi, si = np.unravel_index(keep, base.shape)
+    combos.append(np.column_stack([ti, pi, si, np.full(len(keep), -1)]))
+    scores.append(block[keep])
+
+    combos = np.concatenate(combos)
+    scores = np.concatenate(scores)
+    # stable sort keeps product order among equal scores, like list.sort
+    order = _top_k_order(scores, k)[offset:]
 
-    # sort by score descending
-    outfits.sort(key=lambda o: o['score'], reverse=True)
+    outfits = []
+    for (ti, pi, si, ji), score in zip(combos[order].tolist(), scores[order].tolist()):
+        outfits.append({
+            'top':    tops[ti],
+            'pants':  pants[pi],
+            'shoes':  shoes[si],
+            'jacket': jackets[ji] if ji >= 0 else None,
+            'score':  score
+        })
     return outfits
 
-def suggest_outfit_for_item(user_input, wardrobe):
+OOTD_MAX_TRIES = 2000
+
+def sample_outfit(wardrobe, rng, pair_scores=None, max_tries=OOTD_MAX_TRIES, scoring=None):
+    """
+    One outfit drawn uniformly from those generate_outfit_suggestions returns,
+    without enumerating them: random combinations (rng: a random.Random) are
+    scored from the pair matrices until one passes MIN_ACCEPTABLE_SCORE. Only
+    when max_tries draws all fail does it fall back to the full list.
+    Returns an outfit dict, or None when nothing passes.
+    """
+    tops, pants, shoes = wardrobe['tops'], wardrobe['pants'], wardrobe['shoes']
+    jackets = wardrobe.get('jackets', [])
+    if not (tops and pants and shoes):
+        return None
+
+    scoring = scoring or OUTFIT_SCORING
+    tables = _score_tables(scoring)
+    pairs = _pair_matrices(wardrobe, pair_scores, scoring)
+    for _ in range(max_tries):
+        ti, pi, si = rng.randrange(len(tops)), rng.randrange(len(pants)), rng.randrange(len(shoes))
+        # index len(jackets) stands for "no jacket"
+        ji = rng.randrange(len(jackets) + 1) if jackets else 0
+        total = int(pairs['tops', 'pants'][ti, pi]) + int(pairs['tops', 'shoes'][ti, si]) + int(pairs['pants', 'shoes'][pi, si])
+        if ji < len(jackets):
+            total += (int(pairs['tops', 'jackets'][ti, ji]) + int(pairs['pants', 'jackets'][pi, ji])
+                      + int(pairs['shoes', 'jackets'][si, ji]))
+            score = tables[6][total]
+        else:
+            score = tables[3][total]
+        if score > MIN_ACCEPTABLE_SCORE:
+            return {
+                'top':    tops[ti],
+                'pants':  pants[pi],
+                'shoes':  shoes[si],
+                'jacket': jackets[ji] if ji < len(jackets) else None,
+                'score':  float(score)
+            }
+
+    outfits = generate_outfit_suggestions(wardrobe, pair_scores=pair_scores, scoring=scoring)
+    return rng.choice(outfits) if outfits else None
+
+def suggest_outfit_for_item(user_input, wardrobe, engine=None, pair_scores=None, limit=None, offset=0, scoring=None):
     """
     user_input: dict like {
                             'id': item_id,
@@ -171,8 +632,21 @@ def suggest_outfit_for_item(user_input, wardrobe):
             'jacket': { … } or None,
             'score':  float
         }
+    engine, pair_scores, limit, offset, scoring: as in generate_outfit_suggestions
     """
-    
+    engine = engine or OUTFIT_ENGINE
+    scoring = scoring or OUTFIT_SCORING
+    started = time.perf_counter()
+    if engine == 'numpy':
+        outfits = _suggest_outfit_for_item_numpy(user_input, wardrobe, pair_scores, limit, offset, scoring)
+    elif engine == 'python':
+        outfits = _sorted_page(_suggest_outfit_for_item_python(user_input, wardrobe, scoring), limit, offset)
+    else:
+        raise ValueError(f"Unknown outfit engine: {engine}")
+    OUTFIT_SCORING_SECONDS.observe(time.perf_counter() - started, engine, 'suggest')
+    return outfits
+
+def _suggest_outfit_for_item_python(user_input, wardrobe, scoring='dominant'):
     valid_types = {"tops", "pants", "shoes", "jackets"}
 
     wardrobe_items = {t: wardrobe.get(t, []) for t in valid_types}
@@ -181,12 +655,15 @@ def suggest_outfit_for_item(user_input, wardrobe):
     jacket_options_with_none = jacket_options + [None] if has_jackets else [None]
 
     suggestions = []
+    evaluated = 0
 
     def build_outfit(top, pant, shoe, jacket):
-        colors = [top['rgb'], pant['rgb'], shoe['rgb']]
+        nonlocal evaluated
+        evaluated += 1
+        items = [top, pant, shoe]
         if jacket:
-            colors.append(jacket['rgb'])
-        score = _score_outfit(*colors)
+            items.append(jacket)
+        score = _score_items(*items, scoring=scoring)
         if score > MIN_ACCEPTABLE_SCORE:
             suggestions.append({
                 'top': top,
@@ -200,30 +677,79 @@ def suggest_outfit_for_item(user_input, wardrobe):
         for pant in wardrobe_items["pants"]:
             for shoe in wardrobe_items["shoes"]:
                 for jacket in jacket_options_with_none:
-                    top = {'id': user_input['id'], 'rgb': user_input['rgb'], 'image': user_input['image']}
+                    top = {'id': user_input['id'], 'rgb': user_input['rgb'], 'image': user_input['image'], 'features': user_input.get('features'), 'palette': user_input.get('palette')}
                     build_outfit(top, pant, shoe, jacket)
     elif user_input['type'] == "pants":
         for top in wardrobe_items["tops"]:
             for shoe in wardrobe_items["shoes"]:
                 for jacket in jacket_options_with_none:
-                    pant = {'id': user_input['id'], 'rgb': user_input['rgb'], 'image': user_input['image']}
+                    pant = {'id': user_input['id'], 'rgb': user_input['rgb'], 'image': user_input['image'], 'features': user_input.get('features'), 'palette': user_input.get('palette')}
                     build_outfit(top, pant, shoe, jacket)
     elif user_input['type'] == "shoes":
         for top in wardrobe_items["tops"]:
             for pant in wardrobe_items["pants"]:
                 for jacket in jacket_options_with_none:
-                    shoe = {'id': user_input['id'], 'rgb': user_input['rgb'], 'image': user_input['image']}
+                    shoe = {'id': user_input['id'], 'rgb': user_input['rgb'], 'image': user_input['image'], 'features': user_input.get('features'), 'palette': user_input.get('palette')}
                     build_outfit(top, pant, shoe, jacket)
     elif user_input['type'] == "jackets":
         for top in wardrobe_items["tops"]:
             for pant in wardrobe_items["pants"]:
                 for shoe in wardrobe_items["shoes"]:
-                    jacket = {'id': user_input['id'], 'rgb': user_input['rgb'], 'image': user_input['image']}
+                    jacket = {'id': user_input['id'], 'rgb': user_input['rgb'], 'image': user_input['image'], 'features': user_input.get('features'), 'palette': user_input.get('palette')}
                     build_outfit(top, pant, shoe, jacket)
 
+    OUTFIT_COMBINATIONS.inc('python', 'suggest', amount=evaluated)
+    OUTFITS_KEPT.inc('python', 'suggest', amount=len(suggestions))
+
     suggestions.sort(key=lambda o: o['score'], reverse=True)
     return suggestions
 
+def _suggest_outfit_for_item_numpy(user_input, wardrobe, pair_scores=None, limit=None, offset=0, scoring='dominant'):
+    item_type = user_input['type']
+    tables = _score_tables(scoring)
+    if item_type not in CLOTHING_TYPES:
+        return []
+
+    fixed = {'id': user_input['id'], 'rgb': user_input['rgb'], 'image': user_input['image'], 'features': user_input.get('features'), 'palette': user_input.get('palette')}
+    options = {t: list(wardrobe.get(t, [])) for t in CLOTHING_TYPES}
+    options[item_type] = [fixed]
+    tops, pants, shoes, jackets = (options[t] for t in CLOTHING_TYPES)
+    if not (tops and pants and shoes):
+        return []
+
+    pairs = _pair_matrices(options, pair_scores, scoring)
+    base = _base_totals(pairs)
+    # Same nesting as the loop version: jacket innermost, "no jacket" after the
+    # jackets unless the chosen item is itself the jacket.
+    if jackets:
+        totals = (base[:, :, :, None] + pairs['tops', 'jackets'][:, None, None, :]
+                  + _jacket_totals(pairs)[None, :, :, :])
+        scores = tables[6][totals]
+        if item_type != 'jackets':
+            scores = np.concatenate([scores, tables[3][base][..., None]], axis=3)
+            jackets = jackets + [None]
+    else:
+        scores = tables[3][base][..., None]
+        jackets = [None]
+
+    flat = scores.ravel()
+    keep = np.flatnonzero(flat > MIN_ACCEPTABLE_SCORE)
+    OUTFIT_COMBINATIONS.inc('numpy', 'suggest', amount=flat.size)
+    OUTFITS_KEPT.inc('numpy', 'suggest', amount=len(keep))
+    keep = keep[_top_k_order(flat[keep], None if limit is None else offset + limit)[offset:]]
+    combos = np.column_stack(np.unravel_index(keep, scores.shape))
+
+    return [
+        {
+            'top': tops[ti],
+            'pants': pants[pi],
+            'shoes': shoes[si],
+            'jacket': jackets[ji],
+            'score': score
+        }
+        for (ti, pi, si, ji), score in zip(combos.tolist(), flat[keep].tolist())
+    ]
+
 def prompt_user_for_clothing_types(wardrobe):
     print("Your Wardrobe contains the following categories:")
     for clothing_type in wardrobe.keys():
@@ -254,12 +780,13 @@ def generate_outfits_based_on_selection(wardrobe, selected_types):
         desc = [f"{ctype.capitalize()}: {_closest_color_name(c)}" for ctype, c in zip(selected_types, combo)]
         print(" | ".join(desc) + f" | Score: {round(score, 2)}")
 
-def suggestions_for_item(user_input):
+def suggestions_for_item(user_input, swatch_image=generate_color_box_base64):
     """
     Suggests matching color combinations for a given clothing item.
     Not based on wardrobe — provides guidance for potential future purchases.
 
     :param user_input: dict — 'type': one of "tops", "pants", "shoes", or "jackets", 'rgb': (R, G, B) values of the chosen item
+    :param swatch_image: rgb -> image src for each suggested color, e.g. a swatch URL; defaults to an inline base64 PNG
     :return: list of suggestions, each as a dict of id, item-type to RGB values, image
     """
 
@@ -347,10 +874,10 @@ def suggestions_for_item(user_input):
         score = _score_outfit(*colors)
         if score >= 3.0:
             suggestions.append({
-                'top': {'rgb': parts['top'], 'image': generate_color_box_base64(parts['top'])},
-                'pants': {'rgb': parts['pants'], 'image': generate_color_box_base64(parts['pants'])},
-                'shoes': {'rgb': parts['shoes'], 'image': generate_color_box_base64(parts['shoes'])},
-                'jacket': {'rgb': parts['jacket'], 'image': generate_color_box_base64(parts['jacket'])} if parts['jacket'] else None,
+                'top': {'rgb': parts['top'], 'image': swatch_image(parts['top'])},
+                'pants': {'rgb': parts['pants'], 'image': swatch_image(parts['pants'])},
+                'shoes': {'rgb': parts['shoes'], 'image': swatch_image(parts['shoes'])},
+                'jacket': {'rgb': parts['jacket'], 'image': swatch_image(parts['jacket'])} if parts['jacket'] else None,
                 'score': round(score, 2)
             })
 
@@ -1,7 +1,20 @@
 import psycopg2
+from psycopg2 import pool
+from psycopg2.extras import execute_values
 import bcrypt
 import os
+import random
+import threading
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from contextlib import contextmanager
 from dotenv import load_dotenv
+import pair_scores
+from color_index import ColorIndex
+from wardrobe_cache import WardrobeCache, create_backend
+from colors_test import (generate_outfit_suggestions, suggest_outfit_for_item, sample_outfit, color_features,
+                         _score_items, OUTFIT_SCORING)
+from metrics import Counter, Histogram, FAST_BUCKETS
 
 load_dotenv()
 
@@ -19,6 +32,17 @@ DB_CONFIG = {
     'password': DB_PASSWORD
 }
 
+# Connection pool, one per process: DB_POOL_MIN connections stay open, up to DB_POOL_MAX under load
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 4))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))          # seconds to wait for a free connection
+DB_POOL_CHECK_IDLE = float(os.getenv('DB_POOL_CHECK_IDLE', 30))    # ping connections idle longer than this
+
+# Query metrics, labelled by statement type (select, insert, update, delete, other)
+DB_QUERY_SECONDS = Histogram('db_query_seconds', 'Database statement duration', ('operation',), FAST_BUCKETS)
+DB_QUERY_ERRORS = Counter('db_query_errors_total', 'Database statements that raised', ('operation',))
+DB_POOL_WAIT_SECONDS = Histogram('db_pool_wait_seconds', 'Time spent waiting for a pooled connection', (), FAST_BUCKETS)
+
 def create_user(email, username, password):
     hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
     with get_connection() as conn:
@@ -42,43 +66,51 @@ def mark_user_as_confirmed(email):
 def validate_user(identifier, password):
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT * FROM users WHERE (username = %s OR email = %s) AND confirmed = TRUE", (identifier, identifier))
+            cur.execute("""
+                SELECT id, username, password, email, confirmed, profile_pic, profile_pic_thumbnail_format
+                FROM users
+                WHERE (username = %s OR email = %s) AND confirmed = TRUE
+            """, (identifier, identifier))
             row = cur.fetchone()
             if row:
-                id, username, hashed_pw, email, confirmed, profile_pic = row
+                id, username, hashed_pw, email, confirmed, profile_pic, profile_pic_thumbnail_format = row
                 if bcrypt.checkpw(password.encode(), hashed_pw.encode()):
                     return row
     return None
 
-def update_user_account(user_id, username=None, password=None, profile_pic=None):
+def update_user_account(user_id, username=None, password=None, profile_pic=None, profile_pic_thumbnail_format=None):
     with get_connection() as conn:  
         with conn.cursor() as cur:
             if username and password:
                 hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
                 cur.execute("""
-                    UPDATE users SET username = %s, password = %s, profile_pic = %s WHERE id = %s
-                """, (username, hashed, profile_pic, user_id))
+                    UPDATE users SET username = %s, password = %s, profile_pic = %s, profile_pic_thumbnail_format = %s
+                    WHERE id = %s
+                """, (username, hashed, profile_pic, profile_pic_thumbnail_format, user_id))
 
             elif username:
                 cur.execute("""
-                    UPDATE users SET username = %s, profile_pic = %s WHERE id = %s
-                """, (username, profile_pic, user_id))
+                    UPDATE users SET username = %s, profile_pic = %s, profile_pic_thumbnail_format = %s WHERE id = %s
+                """, (username, profile_pic, profile_pic_thumbnail_format, user_id))
 
             elif password:
                 hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
                 cur.execute("""
-                    UPDATE users SET password = %s, profile_pic = %s WHERE id = %s
-                """, (hashed, profile_pic, user_id))
+                    UPDATE users SET password = %s, profile_pic = %s, profile_pic_thumbnail_format = %s WHERE id = %s
+                """, (hashed, profile_pic, profile_pic_thumbnail_format, user_id))
 
             elif profile_pic:
                 cur.execute("""
-                    UPDATE users SET profile_pic = %s WHERE id = %s
-                """, (profile_pic, user_id))
+                    UPDATE users SET profile_pic = %s, profile_pic_thumbnail_format = %s WHERE id = %s
+                """, (profile_pic, profile_pic_thumbnail_format, user_id))
 
 def delete_user_account(username):
+    wardrobe_id = get_wardrobe_id(username)
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM users WHERE username=%s", (username,))
+    wardrobe_cache.bump(wardrobe_id)
+    pair_scores.forget_wardrobe(wardrobe_id)
 
 def get_wardrobe_id(username):
     with get_connection() as conn:
@@ -93,60 +125,391 @@ def get_wardrobe_id(username):
             return row[0] if row else None
 
 
+_SQL_OPERATIONS = {'select', 'insert', 'update', 'delete'}
+
+def _sql_operation(query):
+    # first keyword only; execute_values hands over (possibly huge) bytes
+    if isinstance(query, bytes):
+        query = query[:64].decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        return 'other'
+    words = query[:64].split(None, 1)
+    operation = words[0].lower() if words else ''
+    return operation if operation in _SQL_OPERATIONS else 'other'
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor recording every statement in DB_QUERY_SECONDS / DB_QUERY_ERRORS."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except Exception:
+            DB_QUERY_ERRORS.inc(_sql_operation(query))
+            raise
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, _sql_operation(query))
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        except Exception:
+            DB_QUERY_ERRORS.inc(_sql_operation(query))
+            raise
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, _sql_operation(query))
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 pool: blocks up to DB_POOL_TIMEOUT when all DB_POOL_MAX
+    connections are busy and pings connections that sat idle before handing them out.
+    """
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 check_idle=DB_POOL_CHECK_IDLE, **config):
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **config)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self.timeout = timeout
+        self.check_idle = check_idle
+
+    def getconn(self):
+        started = time.perf_counter()
+        acquired = self._slots.acquire(timeout=self.timeout)
+        DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+        if not acquired:
+            raise pool.PoolError(f"No free database connection after {self.timeout}s")
+        try:
+            conn = self._pool.getconn()
+            if not self._is_healthy(conn):
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def putconn(self, conn, close=False):
+        try:
+            self._pool.putconn(conn, close=close or bool(conn.closed))
+            if conn.closed:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool, _pool_pid
+    # created lazily, and again in a forked worker: connections must not be shared across processes
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(cursor_factory=TimedCursor, **DB_CONFIG)
+                _pool_pid = os.getpid()
+    return _pool
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+@contextmanager
 def get_connection():
-    return psycopg2.connect(**DB_CONFIG)
+    """Pooled connection; commits on success, rolls back on error, then goes back to the pool."""
+    db_pool = get_pool()
+    conn = db_pool.getconn()
+    broken = False
+    try:
+        with conn:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        db_pool.putconn(conn, close=broken)
 
-def insert_clothing_item(wardrobe_id, clothing_type, rgb, image_filename):
+def insert_clothing_item(wardrobe_id, clothing_type, rgb, image_filename, color_name=None, palette=None,
+                         thumbnail_format=None):
+    item = {
+        'type': clothing_type,
+        'rgb': tuple(rgb),
+        'image': image_filename,
+        'color_name': color_name,
+        'thumbnail_format': thumbnail_format,
+        'features': color_features(tuple(rgb)),
+        'palette': palette
+    }
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO clothing_items (wardrobe_id, type, r, g, b, image_filename)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (wardrobe_id, clothing_type, rgb[0], rgb[1], rgb[2], image_filename))
+            # row lock serializes writers of one wardrobe, so concurrent uploads see each other's items
+            materialized = _lock_wardrobe(cur, wardrobe_id)
+            cur.execute(f"""
+                INSERT INTO clothing_items (wardrobe_id, type, r, g, b, image_filename, color_name, thumbnail_format,
+                                            {_FEATURE_COLUMNS})
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, {', '.join(['%s'] * _FEATURE_COUNT)})
+                RETURNING id
+            """, (wardrobe_id, clothing_type, rgb[0], rgb[1], rgb[2], image_filename, color_name, thumbnail_format,
+                  *_feature_values(item['features'])))
+            item['id'] = cur.fetchone()[0]
+            _insert_palettes(cur, {item['id']: palette})
+
+            # Only the outfits that contain the new item are added
+            if materialized:
+                wardrobe = _query_wardrobe_items(cur, wardrobe_id)
+                outfits = suggest_outfit_for_item(item, wardrobe,
+                                                  pair_scores=pair_scores.get_pair_scores(wardrobe_id, wardrobe))
+                _insert_generated_outfits(cur, wardrobe_id, outfits)
+
+    wardrobe_cache.bump(wardrobe_id)
+    pair_scores.item_added(wardrobe_id, clothing_type, item)
+    return item['id']
+
+
+def insert_clothing_items(wardrobe_id, items):
+    """
+    Bulk version of insert_clothing_item: items is
+    [{'type', 'rgb', 'image', 'color_name', 'palette'?, 'thumbnail_format'?}, …],
+    inserted with one multi-row statement. Returns the new ids in the same order.
+    """
+    if not items:
+        return []
+    items = [dict(it, rgb=tuple(it['rgb']), features=color_features(tuple(it['rgb'])), palette=it.get('palette'),
+                  thumbnail_format=it.get('thumbnail_format'))
+             for it in items]
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            materialized = _lock_wardrobe(cur, wardrobe_id)
+            rows = execute_values(cur, f"""
+                INSERT INTO clothing_items (wardrobe_id, type, r, g, b, image_filename, color_name, thumbnail_format,
+                                            {_FEATURE_COLUMNS})
+                VALUES %s
+                RETURNING id
+            """, [
+                (wardrobe_id, it['type'], it['rgb'][0], it['rgb'][1], it['rgb'][2], it['image'], it['color_name'],
+                 it['thumbnail_format'], *_feature_values(it['features']))
+                for it in items
+            ], page_size=len(items), fetch=True)
+            ids = [row[0] for row in rows]
+            _insert_palettes(cur, {item_id: it['palette'] for item_id, it in zip(ids, items)})
+
+            # Many new items touch most outfits, so the stored ones are recomputed in the same transaction
+            if materialized:
+                _rebuild_generated_outfits(cur, wardrobe_id)
+
+    wardrobe_cache.bump(wardrobe_id)
+    for item_id, it in zip(ids, items):
+        pair_scores.item_added(wardrobe_id, it['type'], dict(it, id=item_id))
+    return ids
+
+
+def _insert_palettes(cur, palettes):
+    # palettes: {item_id: [(rgb, weight), …] or None}
+    rows = [(item_id, position, *rgb, weight)
+            for item_id, palette in palettes.items() for position, (rgb, weight) in enumerate(palette or [])]
+    if rows:
+        execute_values(cur, """
+            INSERT INTO clothing_item_palette (item_id, position, r, g, b, weight)
+            VALUES %s
+        """, rows, page_size=len(rows))
 
 
 def fetch_wardrobe_items(wardrobe_id):
+    # Served from wardrobe_cache; the returned dict is shared, do not modify it
+    return wardrobe_cache.get(wardrobe_id)
+
+def _load_wardrobe_items(wardrobe_id):
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                SELECT id, type, r, g, b, image_filename
-                FROM clothing_items
-                WHERE wardrobe_id = %s
-                ORDER BY type
-            """, (wardrobe_id,))
-            rows = cur.fetchall()
+            return _query_wardrobe_items(cur, wardrobe_id)
+
+wardrobe_cache = WardrobeCache(create_backend(), _load_wardrobe_items)
+
+class Wardrobe(dict):
+    """
+    {'tops': [item, …], 'pants': […], 'shoes': […], 'jackets': […]} as before,
+    plus by_id: item id -> item, so single-item pages skip scanning every category.
+    """
+
+    def __init__(self):
+        super().__init__(tops=[], pants=[], shoes=[], jackets=[])
+        self.by_id = {}
+
+    def add(self, item):
+        if item['type'] in self:
+            self[item['type']].append(item)
+            self.by_id[item['id']] = item
+
+# Stored colors_test.color_features, see migrations/005_clothing_items_color_features.sql
+_FEATURE_COLUMNS = "hsv_h, hsv_s, hsv_v, comp_r, comp_g, comp_b, neutral, neutral_distance, lab_l, lab_a, lab_b"
+_FEATURE_COUNT = len(_FEATURE_COLUMNS.split(', '))
+
+def _feature_values(features):
+    return (*features['hsv'], *features['complementary'], features['neutral'],
+            features['neutral_distance'], *features['lab'])
+
+def _features_from_values(values):
+    if values[0] is None:
+        return None  # not backfilled yet; the engine computes them from rgb
+    h, s, v, comp_r, comp_g, comp_b, neutral, neutral_distance, lab_l, lab_a, lab_b = values
+    return {
+        'hsv': (h, s, v),
+        'complementary': (comp_r, comp_g, comp_b),
+        'neutral': neutral,
+        'neutral_distance': neutral_distance,
+        'lab': (lab_l, lab_a, lab_b)
+    }
+
+_ITEM_COLUMNS = f"id, type, r, g, b, image_filename, color_name, thumbnail_format, {_FEATURE_COLUMNS}"
+
+def _item_from_row(row):
+    item_id, clothing_type, r, g, b, image_filename, color_name, thumbnail_format = row[:8]
+    return {
+        'id': item_id,
+        'type': clothing_type,
+        'rgb': (r, g, b),
+        'image': image_filename,
+        'color_name': color_name,
+        'thumbnail_format': thumbnail_format,
+        'features': _features_from_values(row[8:]),
+        'palette': None  # filled in by _attach_palettes when the whole wardrobe is loaded
+    }
+
+def _attach_palettes(wardrobe, rows):
+    # rows: (item_id, r, g, b, weight) ordered by item and position
+    for item_id, r, g, b, weight in rows:
+        item = wardrobe.by_id.get(item_id)
+        if item is not None:
+            if item['palette'] is None:
+                item['palette'] = []
+            item['palette'].append(((r, g, b), weight))
+
+def _query_wardrobe_items(cur, wardrobe_id):
+    cur.execute(f"""
+        SELECT {_ITEM_COLUMNS}
+        FROM clothing_items
+        WHERE wardrobe_id = %s
+        ORDER BY type, id
+    """, (wardrobe_id,))
+    rows = cur.fetchall()
     
-    wardrobe = {'tops': [], 'pants': [], 'shoes': [], 'jackets': []}
-    for item_id, clothing_type, r, g, b, image_filename in rows:
-        if clothing_type in wardrobe:
-            wardrobe[clothing_type].append({
-                'id': item_id,
-                'rgb': (r, g, b),
-                'image': image_filename
-            })
+    wardrobe = Wardrobe()
+    for row in rows:
+        wardrobe.add(_item_from_row(row))
+
+    cur.execute("""
+        SELECT p.item_id, p.r, p.g, p.b, p.weight
+        FROM clothing_item_palette p
+        JOIN clothing_items c ON c.id = p.item_id
+        WHERE c.wardrobe_id = %s
+        ORDER BY p.item_id, p.position
+    """, (wardrobe_id,))
+    _attach_palettes(wardrobe, cur.fetchall())
     return wardrobe
 
-def save_outfit(wardrobe_id, top_id, pant_id, shoe_id, jacket_id, score):
+def fetch_clothing_item(wardrobe_id, item_id):
+    # Primary key lookup; the wardrobe_id condition makes other users' items invisible
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                SELECT 1 FROM Outfit
-                WHERE wardrobe_id = %s
-                AND top_id = %s
-                AND pant_id = %s
-                AND shoe_id = %s
-                AND (jacket_id = %s OR (jacket_id IS NULL AND %s IS NULL))
-            """, (wardrobe_id, top_id, pant_id, shoe_id, jacket_id, jacket_id))
+            cur.execute(f"""
+                SELECT {_ITEM_COLUMNS}
+                FROM clothing_items
+                WHERE id = %s AND wardrobe_id = %s
+            """, (item_id, wardrobe_id))
+            row = cur.fetchone()
+    return _item_from_row(row) if row else None
+
+def find_similar_items(wardrobe_id, rgb, limit=10, clothing_type=None, exclude_id=None):
+    """
+    The wardrobe's items closest in colour to rgb as [(distance, item), …], from a
+    KD-tree kept in wardrobe_cache until the wardrobe changes.
+    """
+    index = wardrobe_cache.get_derived(wardrobe_id, 'color_index', ColorIndex)
+    return index.nearest(rgb, limit, clothing_type, exclude_id)
 
-            if cur.fetchone():
-                return False # Duplicate exists; skip saving
+def fetch_outfit_of_the_day(wardrobe_id, day=None):
+    """
+    The same outfit all day for a wardrobe: sampled with a (wardrobe, date) seed and
+    cached until midnight, or until the wardrobe changes. None when nothing matches.
+    """
+    day = day or date.today()
+    until_midnight = datetime.combine(day + timedelta(days=1), dt_time.min) - datetime.now()
 
+    def pick(wardrobe):
+        rng = random.Random(f"{wardrobe_id}:{day.isoformat()}")
+        # wrapped so that "no outfit" is cached too
+        return {'outfit': sample_outfit(wardrobe, rng, pair_scores=pair_scores.get_pair_scores(wardrobe_id, wardrobe))}
+
+    cached = wardrobe_cache.get_derived(wardrobe_id, f"ootd:{day.isoformat()}", pick,
+                                        ttl=max(int(until_midnight.total_seconds()), 1))
+    return cached['outfit']
+
+def save_outfit(wardrobe_id, top_id, pant_id, shoe_id, jacket_id):
+    """
+    Saves an outfit by item ids. Items must belong to the wardrobe and have the
+    right type; the score is computed from the items, never taken from the caller.
+    The unique index on Outfit makes repeated saves no-ops.
+    Returns True when saved, False when already saved, None when an item is not valid.
+    """
+    # scored from the cached wardrobe (features and palettes included), so the save is one statement
+    items = fetch_wardrobe_items(wardrobe_id).by_id
+    chosen_ids = (top_id, pant_id, shoe_id) + ((jacket_id,) if jacket_id is not None else ())
+    chosen = [items.get(item_id) for item_id in chosen_ids]
+    if None in chosen:
+        return None
+    score = _score_items(*chosen, scoring=OUTFIT_SCORING)  # same item order as the engine
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            # ownership and types are checked here, against the committed rows
             cur.execute("""
-                INSERT INTO Outfit (wardrobe_id, top_id, pant_id, shoe_id, jacket_id, score)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (wardrobe_id, top_id, pant_id, shoe_id, jacket_id, score))
-            conn.commit()
-            return True # Successfully saved
+                WITH chosen AS (
+                    SELECT t.id AS top_id, p.id AS pant_id, s.id AS shoe_id, j.id AS jacket_id
+                    FROM clothing_items t
+                    JOIN clothing_items p ON p.id = %(pant)s AND p.wardrobe_id = %(wardrobe)s AND p.type = 'pants'
+                    JOIN clothing_items s ON s.id = %(shoe)s AND s.wardrobe_id = %(wardrobe)s AND s.type = 'shoes'
+                    LEFT JOIN clothing_items j ON j.id = %(jacket)s AND j.wardrobe_id = %(wardrobe)s AND j.type = 'jackets'
+                    WHERE t.id = %(top)s AND t.wardrobe_id = %(wardrobe)s AND t.type = 'tops'
+                      AND (%(jacket)s IS NULL OR j.id IS NOT NULL)
+                ), inserted AS (
+                    INSERT INTO Outfit (wardrobe_id, top_id, pant_id, shoe_id, jacket_id, score)
+                    SELECT %(wardrobe)s, top_id, pant_id, shoe_id, jacket_id, %(score)s FROM chosen
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
+                )
+                SELECT EXISTS (SELECT 1 FROM chosen), EXISTS (SELECT 1 FROM inserted)
+            """, {'wardrobe': wardrobe_id, 'top': top_id, 'pant': pant_id, 'shoe': shoe_id,
+                  'jacket': jacket_id, 'score': score})
+            valid, inserted = cur.fetchone()
+    if not valid:
+        return None
+    return inserted
         
 def get_item_id_by_color(wardrobe_id, clothing_type, rgb):
     with get_connection() as conn:
@@ -156,59 +519,305 @@ def get_item_id_by_color(wardrobe_id, clothing_type, rgb):
                 WHERE wardrobe_id = %s AND type = %s AND r = %s AND g = %s AND b = %s
                 LIMIT 1
             """, (wardrobe_id, clothing_type, rgb[0], rgb[1], rgb[2]))
-            row = cur.fetchall()
+            row = cur.fetchone()
             return row[0] if row else None
             
+# Outfit rows (saved or generated, aliased "o") joined with their up to four items
+_OUTFIT_ITEM_COLUMNS = """
+    t.id, t.r, t.g, t.b, t.image_filename, t.thumbnail_format,
+    p.id, p.r, p.g, p.b, p.image_filename, p.thumbnail_format,
+    s.id, s.r, s.g, s.b, s.image_filename, s.thumbnail_format,
+    j.id, j.r, j.g, j.b, j.image_filename, j.thumbnail_format
+"""
+_OUTFIT_ITEM_JOINS = """
+    LEFT JOIN clothing_items t ON t.id = o.top_id
+    LEFT JOIN clothing_items p ON p.id = o.pant_id
+    LEFT JOIN clothing_items s ON s.id = o.shoe_id
+    LEFT JOIN clothing_items j ON j.id = o.jacket_id
+"""
+
+def _item_from_columns(item_id, r, g, b, image_filename, thumbnail_format):
+    if item_id is None:
+        return None
+    return {
+        'id': item_id,
+        'rgb': (int(r), int(g), int(b)),
+        'image': image_filename,
+        'thumbnail_format': thumbnail_format
+    }
+
+def _outfit_from_row(row):
+    # row: (score, *_OUTFIT_ITEM_COLUMNS)
+    return {
+        'top': _item_from_columns(*row[1:7]),
+        'pants': _item_from_columns(*row[7:13]),
+        'shoes': _item_from_columns(*row[13:19]),
+        'jacket': _item_from_columns(*row[19:25]),
+        'score': row[0]
+    }
+
+def _outfits_from_rows(rows):
+    return [_outfit_from_row(row) for row in rows]
+
+# Rows fetched per round trip when outfits are streamed
+OUTFIT_STREAM_ROWS = int(os.getenv('OUTFIT_STREAM_ROWS', 100))
+
+def _iter_outfits(query, params):
+    """
+    Outfits one at a time from a server-side cursor, OUTFIT_STREAM_ROWS rows per
+    fetch, so memory does not grow with the result. The pooled connection is held
+    until the generator is exhausted or closed.
+    """
+    with get_connection() as conn:
+        with conn.cursor(name='outfit_stream') as cur:
+            cur.itersize = OUTFIT_STREAM_ROWS
+            cur.execute(query, params)
+            for row in cur:
+                yield _outfit_from_row(row)
+
+_SAVED_OUTFITS_QUERY = f"""
+    SELECT o.score, {_OUTFIT_ITEM_COLUMNS}
+    FROM Outfit o
+    {_OUTFIT_ITEM_JOINS}
+    WHERE o.wardrobe_id = %s
+    ORDER BY o.score DESC, o.id
+"""
+
 def fetch_saved_outfits(wardrobe_id):
+    # One query: every outfit joined with its items, best score first
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_SAVED_OUTFITS_QUERY, (wardrobe_id,))
+            return _outfits_from_rows(cur.fetchall())
+
+def iter_saved_outfits(wardrobe_id):
+    """fetch_saved_outfits as a generator, for streamed pages."""
+    return _iter_outfits(_SAVED_OUTFITS_QUERY, (wardrobe_id,))
+
+# Materialized outfits (generated_outfits): every passing outfit of a wardrobe, kept
+# in sync by insert_clothing_item/delete_clothing_item so reads are a plain ordered select.
+def _lock_wardrobe(cur, wardrobe_id):
+    cur.execute("SELECT outfits_materialized FROM wardrobe WHERE id = %s FOR UPDATE", (wardrobe_id,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+# Ties in generate_outfit_suggestions come in itertools.product order over the id-sorted
+# wardrobe lists, outfits with a jacket first. Ordering by that instead of the row id gives
+# the engine's order whether the rows came from a rebuild or from incremental inserts.
+_GENERATED_OUTFITS_ORDER = "o.score DESC, o.jacket_id IS NULL, o.top_id, o.pant_id, o.shoe_id, o.jacket_id"
+
+def _insert_generated_outfits(cur, wardrobe_id, outfits):
+    execute_values(cur, """
+        INSERT INTO generated_outfits (wardrobe_id, top_id, pant_id, shoe_id, jacket_id, score)
+        VALUES %s
+    """, [
+        (wardrobe_id, o['top']['id'], o['pants']['id'], o['shoes']['id'],
+         o['jacket']['id'] if o['jacket'] else None, o['score'])
+        for o in outfits
+    ], page_size=1000)
+
+def rebuild_generated_outfits(wardrobe_id):
+    """Recompute every outfit of a wardrobe from scratch. Returns the number of outfits stored."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            _lock_wardrobe(cur, wardrobe_id)
+            return _rebuild_generated_outfits(cur, wardrobe_id)
+
+def _rebuild_generated_outfits(cur, wardrobe_id):
+    # caller holds the wardrobe lock
+    wardrobe = _query_wardrobe_items(cur, wardrobe_id)
+    outfits = generate_outfit_suggestions(wardrobe, pair_scores=pair_scores.get_pair_scores(wardrobe_id, wardrobe))
+    cur.execute("DELETE FROM generated_outfits WHERE wardrobe_id = %s", (wardrobe_id,))
+    _insert_generated_outfits(cur, wardrobe_id, outfits)
+    cur.execute("UPDATE wardrobe SET outfits_materialized = TRUE WHERE id = %s", (wardrobe_id,))
+    return len(outfits)
+
+def backfill_color_features(batch_size=1000):
+    """Stores color_features for items uploaded before they existed. Returns the number of items updated."""
+    updated = 0
+    while True:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, wardrobe_id, r, g, b
+                    FROM clothing_items
+                    WHERE hsv_h IS NULL
+                    ORDER BY id
+                    LIMIT %s
+                """, (batch_size,))
+                rows = cur.fetchall()
+                if not rows:
+                    return updated
+                execute_values(cur, f"""
+                    UPDATE clothing_items c
+                    SET ({_FEATURE_COLUMNS}) = ({', '.join('v.' + col for col in _FEATURE_COLUMNS.split(', '))})
+                    FROM (VALUES %s) AS v (id, {_FEATURE_COLUMNS})
+                    WHERE c.id = v.id
+                """, [(item_id, *_feature_values(color_features((r, g, b)))) for item_id, _, r, g, b in rows],
+                    page_size=len(rows))
+        # cached wardrobes pick the stored features up on their next load
+        for wardrobe_id in {row[1] for row in rows}:
+            wardrobe_cache.bump(wardrobe_id)
+        updated += len(rows)
+
+def fetch_items_without_palette():
+    """(item id, image filename) of every item uploaded before palettes were extracted."""
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
-                SELECT top_id, pant_id, shoe_id, jacket_id, score
-                FROM Outfit
-                WHERE wardrobe_id = %s
-            """, (wardrobe_id,))
-            rows = cur.fetchall()
-
-    outfits = []
-    for top_id, pant_id, shoe_id, jacket_id, score in rows:
-        outfit = {}
-        item_ids = {
-            'top': top_id,
-            'pants': pant_id,
-            'shoes': shoe_id,
-            'jacket': jacket_id
-        }
-
-        for item_type, item_id in item_ids.items():
-            if item_id is None:
-                outfit[item_type] = None
-                continue
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT id, type, r, g, b, image_filename
-                        FROM clothing_items
-                        WHERE id = %s
-                    """, (item_id,))
-                    row = cur.fetchone()
+                SELECT c.id, c.image_filename
+                FROM clothing_items c
+                WHERE NOT EXISTS (SELECT 1 FROM clothing_item_palette p WHERE p.item_id = c.id)
+                ORDER BY c.id
+            """)
+            return cur.fetchall()
 
-            if row:
-                outfit[item_type] = {
-                    'id': row[0],
-                    'rgb': (int(row[2]), int(row[3]), int(row[4])),
-                    'image': row[5]
-                }
-            else:
-                outfit[item_type] = None
+def store_palettes(palettes):
+    """Stores {item_id: [(rgb, weight), …]} for existing items. Returns the ids of the wardrobes touched."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM clothing_item_palette WHERE item_id = ANY(%s)", (list(palettes),))
+            _insert_palettes(cur, palettes)
+            cur.execute("SELECT DISTINCT wardrobe_id FROM clothing_items WHERE id = ANY(%s)", (list(palettes),))
+            wardrobe_ids = [row[0] for row in cur.fetchall()]
+    for wardrobe_id in wardrobe_ids:
+        wardrobe_cache.bump(wardrobe_id)
+    return wardrobe_ids
+
+# Upload jobs (upload_jobs.UploadQueue), stored here so every server process sees them
+def insert_upload_job(job_id, wardrobe_id, category, filename, status, keep_seconds):
+    """Records a new job, and drops jobs that finished more than keep_seconds ago."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM upload_jobs WHERE finished_at < now() - make_interval(secs => %s)",
+                        (keep_seconds,))
+            cur.execute("""
+                INSERT INTO upload_jobs (id, wardrobe_id, category, filename, status)
+                VALUES (%s, %s, %s, %s, %s)
+            """, (job_id, wardrobe_id, category, filename, status))
+
+def finish_upload_job(job_id, status, error=None, item_id=None, rgb=None, color_name=None):
+    """Sets the outcome of a job that is still pending. Returns False when it had already finished."""
+    r, g, b = rgb if rgb else (None, None, None)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE upload_jobs
+                SET status = %s, error = %s, item_id = %s, r = %s, g = %s, b = %s, color_name = %s, finished_at = now()
+                WHERE id = %s AND finished_at IS NULL
+            """, (status, error, item_id, r, g, b, color_name, job_id))
+            return cur.rowcount == 1
+
+def fetch_upload_job(job_id):
+    """The job as a dict (item_id, rgb and color_name once it has finished), or None."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, wardrobe_id, category, filename, status, error, item_id, r, g, b, color_name,
+                       EXTRACT(EPOCH FROM now() - created_at)
+                FROM upload_jobs
+                WHERE id = %s
+            """, (job_id,))
+            row = cur.fetchone()
+    if row is None:
+        return None
+    job_id, wardrobe_id, category, filename, status, error, item_id, r, g, b, color_name, age = row
+    job = {'id': job_id, 'wardrobe_id': wardrobe_id, 'category': category, 'filename': filename,
+           'status': status, 'error': error, 'age': float(age)}
+    if item_id is not None:
+        job.update(item_id=item_id, rgb=(r, g, b), color_name=color_name)
+    return job
+
+def fetch_images_without_thumbnails(thumbnail_format=None):
+    """Item images and profile pictures whose variants are not recorded in thumbnail_format (all when None)."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT image_filename FROM clothing_items
+                WHERE %(format)s IS NULL OR thumbnail_format IS DISTINCT FROM %(format)s
+                UNION
+                SELECT profile_pic FROM users
+                WHERE profile_pic IS NOT NULL
+                  AND (%(format)s IS NULL OR profile_pic_thumbnail_format IS DISTINCT FROM %(format)s)
+                ORDER BY 1
+            """, {'format': thumbnail_format})
+            return [row[0] for row in cur.fetchall()]
+
+def store_thumbnail_format(filenames, thumbnail_format):
+    """Records that the variants of these images were written in thumbnail_format."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE clothing_items SET thumbnail_format = %s WHERE image_filename = ANY(%s)
+                RETURNING wardrobe_id
+            """, (thumbnail_format, list(filenames)))
+            wardrobe_ids = {row[0] for row in cur.fetchall()}
+            cur.execute("UPDATE users SET profile_pic_thumbnail_format = %s WHERE profile_pic = ANY(%s)",
+                        (thumbnail_format, list(filenames)))
+    for wardrobe_id in wardrobe_ids:
+        wardrobe_cache.bump(wardrobe_id)
+
+def ensure_generated_outfits(wardrobe_id):
+    # Wardrobes created before the table existed are built on first read
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT outfits_materialized FROM wardrobe WHERE id = %s", (wardrobe_id,))
+            row = cur.fetchone()
+    if row and not row[0]:
+        rebuild_generated_outfits(wardrobe_id)
+
+_GENERATED_OUTFITS_QUERY = f"""
+    SELECT o.score, {_OUTFIT_ITEM_COLUMNS}
+    FROM generated_outfits o
+    {_OUTFIT_ITEM_JOINS}
+    WHERE o.wardrobe_id = %s
+      AND (%s IS NULL OR %s IN (o.top_id, o.pant_id, o.shoe_id, o.jacket_id))
+    ORDER BY {_GENERATED_OUTFITS_ORDER}
+    LIMIT %s OFFSET %s
+"""
 
-        outfit['score'] = score
-        outfits.append(outfit)
-        outfits.sort(key=lambda o: o['score'], reverse=True)
+def fetch_generated_outfits(wardrobe_id, item_id=None, limit=None, offset=0):
+    """Stored outfits, best first; item_id keeps only outfits containing that item."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_GENERATED_OUTFITS_QUERY, (wardrobe_id, item_id, item_id, limit, offset))
+            return _outfits_from_rows(cur.fetchall())
 
-    return outfits
+def iter_generated_outfits(wardrobe_id, item_id=None, limit=None, offset=0):
+    """fetch_generated_outfits as a generator, for streamed pages."""
+    return _iter_outfits(_GENERATED_OUTFITS_QUERY, (wardrobe_id, item_id, item_id, limit, offset))
+
+def count_generated_outfits(wardrobe_id):
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM generated_outfits WHERE wardrobe_id = %s", (wardrobe_id,))
+            return cur.fetchone()[0]
+
+def fetch_all_wardrobe_ids():
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM wardrobe ORDER BY id")
+            return [row[0] for row in cur.fetchall()]
 
 
 def delete_clothing_item(item_id):
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM clothing_items WHERE id = %s", (item_id,))
+            cur.execute("SELECT wardrobe_id FROM clothing_items WHERE id = %s", (item_id,))
+            row = cur.fetchone()
+            if row:
+                # same lock as the insert and rebuild paths, so none of them can store
+                # outfits read before this delete commits
+                _lock_wardrobe(cur, row[0])
+                cur.execute("DELETE FROM clothing_items WHERE id = %s RETURNING wardrobe_id", (item_id,))
+                row = cur.fetchone()
+            # only the outfits containing the deleted item go
+            if row:
+                cur.execute("""
+                    DELETE FROM generated_outfits
+                    WHERE wardrobe_id = %s AND %s IN (top_id, pant_id, shoe_id, jacket_id)
+                """, (row[0], item_id))
+
+    if row:
+        wardrobe_cache.bump(row[0])
+        pair_scores.item_removed(row[0], item_id)
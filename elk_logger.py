@@ -1,8 +1,165 @@
-from elasticsearch import Elasticsearch
 from datetime import datetime
+import atexit
+import os
+import queue
+import random
+import threading
+import time
+from metrics import Counter
+
+# memory:// keeps documents in process (tests, local dev)
+ELASTICSEARCH_URL = os.getenv('ELASTICSEARCH_URL', 'http://elasticsearch:9200')
+ELK_QUEUE_SIZE = int(os.getenv('ELK_QUEUE_SIZE', 10000))          # events waiting to be sent
+ELK_BATCH_SIZE = int(os.getenv('ELK_BATCH_SIZE', 500))            # documents per bulk request
+ELK_FLUSH_INTERVAL = float(os.getenv('ELK_FLUSH_INTERVAL', 2.0))  # seconds before a partial batch is sent
+# Once the queue is half full, only this share of sampled events (outfits) is kept
+ELK_PRESSURE_SAMPLE_RATE = float(os.getenv('ELK_PRESSURE_SAMPLE_RATE', 0.1))
+
+ELK_EVENTS = Counter('elk_events_total', 'Log events by outcome (sent, failed, dropped, sampled_out)', ('index', 'outcome'))
+
+
+class FakeElasticsearch:
+    """In-process stand-in for the index/bulk subset of the Elasticsearch client."""
+
+    def __init__(self):
+        self.documents = {}  # index -> [document, …]
+        self.bulk_calls = 0
+        self._lock = threading.Lock()
+
+    def index(self, index, document):
+        with self._lock:
+            self.documents.setdefault(index, []).append(document)
+        return {'result': 'created'}
+
+    def bulk(self, operations):
+        with self._lock:
+            self.bulk_calls += 1
+            for action, document in zip(operations[::2], operations[1::2]):
+                self.documents.setdefault(action['index']['_index'], []).append(document)
+        return {'errors': False, 'items': [{'index': {'status': 201}} for _ in operations[::2]]}
+
+
+def create_client(url=ELASTICSEARCH_URL):
+    if url.startswith('memory://'):
+        return FakeElasticsearch()
+    from elasticsearch import Elasticsearch
+    return Elasticsearch(url)
+
+
+class BulkLogger:
+    """
+    Events go into a bounded queue and a background thread sends them with the
+    bulk API, every batch_size documents or flush_interval seconds. Logging never
+    blocks the request: a full queue drops the event, and above half full
+    sampled events are only kept at sample_rate.
+    """
+
+    def __init__(self, client_factory=create_client, queue_size=ELK_QUEUE_SIZE, batch_size=ELK_BATCH_SIZE,
+                 flush_interval=ELK_FLUSH_INTERVAL, sample_rate=ELK_PRESSURE_SAMPLE_RATE):
+        self.client_factory = client_factory
+        self.client = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # started lazily, and again in a forked worker where the thread does not exist
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                    self.client = None
+                self._stop.clear()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='elk-logger', daemon=True)
+                self._thread.start()
+
+    def log(self, index, document, sampled=False):
+        """Queue a document for index. Returns False when it was dropped or sampled out."""
+        if self._stop.is_set():
+            return False
+        self._ensure_started()
+        if sampled and self._queue.qsize() * 2 >= self._queue.maxsize and random.random() >= self.sample_rate:
+            ELK_EVENTS.inc(index, 'sampled_out')
+            return False
+        try:
+            self._queue.put_nowait((index, document))
+            return True
+        except queue.Full:
+            ELK_EVENTS.inc(index, 'dropped')
+            return False
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                event = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                if event is not None:  # None only wakes the thread up, see close()
+                    batch.append(event)
+            except queue.Empty:
+                pass
+            stopping = self._stop.is_set()
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline or stopping:
+                if stopping:
+                    # drain whatever is left before exiting
+                    while True:
+                        try:
+                            event = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if event is not None:
+                            batch.append(event)
+                for start in range(0, len(batch), self.batch_size):
+                    self._send(batch[start:start + self.batch_size])
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                if stopping:
+                    return
+
+    def _send(self, batch):
+        if not batch:
+            return
+        operations = []
+        for index, document in batch:
+            operations.append({'index': {'_index': index}})
+            operations.append(document)
+        try:
+            if self.client is None:
+                self.client = self.client_factory()
+            response = self.client.bulk(operations=operations)
+        except Exception as e:
+            print(f"[ELK] Error sending {len(batch)} log events: {e}")
+            for index, _ in batch:
+                ELK_EVENTS.inc(index, 'failed')
+            return
+        for (index, _), item in zip(batch, response.get('items', [])):
+            status = next(iter(item.values())).get('status', 500)
+            ELK_EVENTS.inc(index, 'sent' if status < 300 else 'failed')
+
+    def close(self, timeout=5.0):
+        """Send everything still queued, then stop the thread (waits up to timeout seconds)."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid():
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass  # the thread is busy sending and will see the stop flag
+            thread.join(timeout)
+        self._thread = None
+
+
+bulk_logger = BulkLogger()
+atexit.register(bulk_logger.close)
 
-# Set up Elasticsearch connection
-es = Elasticsearch("http://elasticsearch:9200")
 
 def log_outfit_to_elasticsearch(outfit: dict, user: dict = None):
     doc = {
@@ -14,10 +171,8 @@ def log_outfit_to_elasticsearch(outfit: dict, user: dict = None):
         "jacket_rgb": outfit["jacket"]["rgb"] if outfit["jacket"] else None,
         "score": outfit["score"]
     }
-    try:
-        es.index(index="outfit-logs", document=doc)
-    except Exception as e:
-        print(f"[ELK] Error logging outfit: {e}")
+    # high volume, so sampled when the queue backs up
+    bulk_logger.log("outfit-logs", doc, sampled=True)
 
 def log_login_to_elasticsearch(user=None, ip=None):
     doc = {
@@ -26,8 +181,4 @@ def log_login_to_elasticsearch(user=None, ip=None):
         "user_email": user.email,
         "user_ip": ip,
     }
-    
-    try:
-        es.index(index="login-logs", document=doc)
-    except Exception as e:
-        print(f"[ELK] Error logging user: {e}")
\ No newline at end of file
+    bulk_logger.log("login-logs", doc)
@@ -214,12 +214,15 @@ class WardrobeApp:
             tk.Label(frame, text=f"Score: {score}", font=("Arial", 11, "italic")).pack(anchor="w")
 
             if not saved:
-                def save_callback(t=top_rgb, p=pant_rgb, s=shoe_rgb, j=jacket_rgb, sc=score):
+                def save_callback(t=top_rgb, p=pant_rgb, s=shoe_rgb, j=jacket_rgb):
                     top_id = get_item_id_by_color(self.wardrobe_id, "tops", t)
                     pant_id = get_item_id_by_color(self.wardrobe_id, "pants", p)
                     shoe_id = get_item_id_by_color(self.wardrobe_id, "shoes", s)
                     jacket_id = get_item_id_by_color(self.wardrobe_id, "jackets", j) if j else None
-                    if save_outfit(self.wardrobe_id, top_id, pant_id, shoe_id, jacket_id, sc):
+                    saved_outfit = save_outfit(self.wardrobe_id, top_id, pant_id, shoe_id, jacket_id)
+                    if saved_outfit is None:
+                        self.log(self.wardrobe_display, "❌ Invalid outfit: an item is missing from this wardrobe.")
+                    elif saved_outfit:
                         self.log(self.wardrobe_display, "Outfit saved!")
                     else: 
                         self.log(self.wardrobe_display, "Outfit already saved!")
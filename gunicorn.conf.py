@@ -0,0 +1,63 @@
+"""
+Production server: gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master before it forks its workers (preload_app),
+so the tables colors_test builds at import (color name index, score tables) exist
+once and are shared copy-on-write by every worker instead of being rebuilt per process.
+Everything that holds threads, processes or sockets (database pool, upload threads,
+batch upload process pool, Elasticsearch logger) is created lazily and recreated
+when a worker finds it was made in another process.
+
+State shared between requests must therefore not live in one worker: upload jobs are
+kept in Postgres, and the wardrobe cache must be shared through Redis
+(WARDROBE_CACHE_URL=redis://…). With the default memory:// cache a change made through
+one worker stays invisible to the others until their entries expire, so the server
+refuses to start more than one worker with it.
+
+Settings come from the environment:
+    PORT               listen port (5002)
+    WEB_CONCURRENCY    worker processes (2 x CPUs + 1); each holds up to DB_POOL_MAX connections
+    GUNICORN_THREADS   threads per worker (4); streamed pages and uploads wait on I/O
+    GUNICORN_TIMEOUT   seconds a request may run before its worker is restarted (60);
+                       must cover the slowest outfit rebuild and batch upload
+"""
+import gc
+import multiprocessing
+import os
+import sys
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5002)}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+# recycle workers now and then so slow leaks (caches, fragmentation) cannot build up
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+preload_app = True
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    # runs after the app was loaded (preload_app), so the cache backend is the one in use
+    from db import wardrobe_cache
+    from wardrobe_cache import LocalBackend
+    if server.cfg.workers > 1 and isinstance(wardrobe_cache.backend, LocalBackend):
+        server.log.error("WARDROBE_CACHE_URL=memory:// keeps a separate wardrobe cache in each of the %d workers; "
+                         "set WARDROBE_CACHE_URL=redis://… or WEB_CONCURRENCY=1", server.cfg.workers)
+        sys.exit(1)
+
+
+def when_ready(server):
+    # the app is loaded; nothing the master opened may be shared with workers
+    import db
+    db.close_pool()
+    # the shared tables move to the permanent generation, so the workers' garbage
+    # collector never writes to (and copies) their pages
+    gc.collect()
+    gc.freeze()
+    server.log.info("Froze %d objects before forking workers", gc.get_freeze_count())
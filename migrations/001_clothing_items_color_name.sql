@@ -0,0 +1,3 @@
+-- Colour name resolved once at upload time instead of on every page render.
+-- Existing rows stay NULL and fall back to closest_color_name() in the templates.
+ALTER TABLE clothing_items ADD COLUMN IF NOT EXISTS color_name TEXT;
@@ -0,0 +1,2 @@
+-- Saved outfits are read per wardrobe, best score first (db.fetch_saved_outfits).
+CREATE INDEX IF NOT EXISTS outfit_wardrobe_score_idx ON Outfit (wardrobe_id, score DESC);
@@ -0,0 +1,17 @@
+-- Materialized outfits: every outfit scoring above MIN_ACCEPTABLE_SCORE, per wardrobe.
+-- Maintained by db.insert_clothing_item / db.delete_clothing_item; rebuild with `flask rebuild-outfits`.
+-- Item columns deliberately have no foreign keys: deleting an item removes its rows
+-- explicitly by wardrobe, which avoids a cascade scan over the whole table.
+CREATE TABLE IF NOT EXISTS generated_outfits (
+    id BIGSERIAL PRIMARY KEY,
+    wardrobe_id INT NOT NULL REFERENCES wardrobe(id) ON DELETE CASCADE,
+    top_id INT NOT NULL,
+    pant_id INT NOT NULL,
+    shoe_id INT NOT NULL,
+    jacket_id INT,
+    score DOUBLE PRECISION NOT NULL
+);
+CREATE INDEX IF NOT EXISTS generated_outfits_wardrobe_score_idx ON generated_outfits (wardrobe_id, score DESC, id);
+
+-- FALSE until the wardrobe's outfits have been built once
+ALTER TABLE wardrobe ADD COLUMN IF NOT EXISTS outfits_materialized BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,13 @@
+-- One saved row per outfit: db.save_outfit inserts with ON CONFLICT DO NOTHING.
+-- Duplicates saved before this constraint existed are removed, keeping the oldest row.
+DELETE FROM Outfit o
+USING Outfit d
+WHERE o.wardrobe_id = d.wardrobe_id
+  AND o.top_id = d.top_id
+  AND o.pant_id = d.pant_id
+  AND o.shoe_id = d.shoe_id
+  AND COALESCE(o.jacket_id, 0) = COALESCE(d.jacket_id, 0)
+  AND o.id > d.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS outfit_unique_items_idx
+    ON Outfit (wardrobe_id, top_id, pant_id, shoe_id, COALESCE(jacket_id, 0));
@@ -0,0 +1,16 @@
+-- Per-item colour features (colors_test.color_features), computed once at upload
+-- and read by the scoring engine instead of being recomputed for every pair.
+-- Existing rows stay NULL (scored from r, g, b as before) until filled with:
+--     flask backfill-color-features
+ALTER TABLE clothing_items
+    ADD COLUMN IF NOT EXISTS hsv_h DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS hsv_s DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS hsv_v DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS comp_r SMALLINT,
+    ADD COLUMN IF NOT EXISTS comp_g SMALLINT,
+    ADD COLUMN IF NOT EXISTS comp_b SMALLINT,
+    ADD COLUMN IF NOT EXISTS neutral BOOLEAN,
+    ADD COLUMN IF NOT EXISTS neutral_distance DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS lab_l DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS lab_a DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS lab_b DOUBLE PRECISION;
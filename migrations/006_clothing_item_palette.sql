@@ -0,0 +1,12 @@
+-- Main colours of each item (colors_test.get_palette), heaviest first, written at upload.
+-- Used when OUTFIT_SCORING=palette; items without rows score on their dominant colour.
+-- Fill in existing items with `flask backfill-palettes`.
+CREATE TABLE IF NOT EXISTS clothing_item_palette (
+    item_id INT NOT NULL REFERENCES clothing_items(id) ON DELETE CASCADE,
+    position SMALLINT NOT NULL,
+    r SMALLINT NOT NULL,
+    g SMALLINT NOT NULL,
+    b SMALLINT NOT NULL,
+    weight DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (item_id, position)
+);
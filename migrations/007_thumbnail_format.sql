@@ -0,0 +1,6 @@
+-- Format of the sized variants written for an image (thumbnails.THUMBNAIL_FORMAT),
+-- NULL while it has none, so pages link the variants without checking the disk.
+-- Variants are named <upload>~<size>.<ext>; write them for existing images with
+-- `flask backfill-thumbnails`.
+ALTER TABLE clothing_items ADD COLUMN IF NOT EXISTS thumbnail_format TEXT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_pic_thumbnail_format TEXT;
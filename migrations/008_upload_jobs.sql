@@ -0,0 +1,19 @@
+-- Background upload jobs (upload_jobs.UploadQueue). Kept in the database rather than in the
+-- process that runs them, so a status request or /wardrobe visit served by another worker
+-- still finds the job. Finished jobs are deleted UPLOAD_JOBS_KEEP_SECONDS after they end.
+CREATE TABLE IF NOT EXISTS upload_jobs (
+    id TEXT PRIMARY KEY,
+    wardrobe_id INT NOT NULL REFERENCES wardrobe(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    item_id INT,
+    r SMALLINT,
+    g SMALLINT,
+    b SMALLINT,
+    color_name TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS upload_jobs_finished_at_idx ON upload_jobs (finished_at);
@@ -0,0 +1,5 @@
+-- Equal scores are ordered like the engine returns them (db._GENERATED_OUTFITS_ORDER)
+-- instead of by row id, which incremental inserts do not keep in engine order.
+CREATE INDEX IF NOT EXISTS generated_outfits_wardrobe_order_idx
+    ON generated_outfits (wardrobe_id, score DESC, (jacket_id IS NULL), top_id, pant_id, shoe_id, jacket_id);
+DROP INDEX IF EXISTS generated_outfits_wardrobe_score_idx;
@@ -0,0 +1,133 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from colors_test import CLOTHING_TYPES, CATEGORY_PAIRS, _item_color_arrays, _pair_score_matrix
+
+# How many wardrobes keep their pair matrix in memory (least recently used are dropped)
+PAIR_SCORE_CACHE_SIZE = int(os.getenv('PAIR_SCORE_CACHE_SIZE', 256))
+
+
+class PairScoreMatrix:
+    """
+    Pair scores (3/2/1/0) between every two items of a wardrobe, one int8 matrix
+    per category pair, e.g. scores['tops', 'pants'][i, j] for the i-th top and j-th pants.
+    Items are appended/removed incrementally, so an upload only scores the new
+    item's row and column instead of rebuilding everything.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.item_ids = {t: [] for t in CLOTHING_TYPES}
+        self.features = {t: _item_color_arrays([]) for t in CLOTHING_TYPES}
+        self.scores = {pair: np.zeros((0, 0), dtype=np.int8) for pair in CATEGORY_PAIRS}
+        self._positions = {}  # item id -> (type, row/column index)
+
+    @classmethod
+    def from_wardrobe(cls, wardrobe):
+        matrix = cls()
+        matrix.add_items(wardrobe)
+        return matrix
+
+    def add_item(self, clothing_type, item):
+        self.add_items({clothing_type: [item]})
+
+    def add_items(self, wardrobe):
+        """wardrobe: {type: [ { 'id':…, 'rgb':… }, … ]}; items already present are skipped."""
+        with self._lock:
+            for clothing_type in CLOTHING_TYPES:
+                new_items = [it for it in wardrobe.get(clothing_type, []) if it['id'] not in self._positions]
+                if new_items:
+                    self._append(clothing_type, new_items)
+
+    def _append(self, clothing_type, items):
+        new = _item_color_arrays(items)
+        for a, b in CATEGORY_PAIRS:
+            if a == clothing_type:
+                rows = _pair_score_matrix(new, self.features[b])
+                self.scores[a, b] = np.vstack([self.scores[a, b], rows])
+            elif b == clothing_type:
+                cols = _pair_score_matrix(self.features[a], new)
+                self.scores[a, b] = np.hstack([self.scores[a, b], cols])
+
+        old = self.features[clothing_type]
+        self.features[clothing_type] = type(old)(*(np.concatenate([x, y]) for x, y in zip(old, new)))
+        ids = self.item_ids[clothing_type]
+        for it in items:
+            self._positions[it['id']] = (clothing_type, len(ids))
+            ids.append(it['id'])
+
+    def remove_item(self, item_id):
+        with self._lock:
+            if item_id not in self._positions:
+                return
+            clothing_type, index = self._positions.pop(item_id)
+            for a, b in CATEGORY_PAIRS:
+                if a == clothing_type:
+                    self.scores[a, b] = np.delete(self.scores[a, b], index, axis=0)
+                elif b == clothing_type:
+                    self.scores[a, b] = np.delete(self.scores[a, b], index, axis=1)
+
+            old = self.features[clothing_type]
+            self.features[clothing_type] = type(old)(*(np.delete(x, index, axis=0) for x in old))
+            ids = self.item_ids[clothing_type]
+            del ids[index]
+            for i in range(index, len(ids)):
+                self._positions[ids[i]] = (clothing_type, i)
+
+    def lookup(self, wardrobe):
+        """
+        Pair matrices with rows/columns in the order of the given wardrobe lists,
+        or None if any of its items is not in the matrix.
+        """
+        with self._lock:
+            indices = {}
+            for clothing_type in CLOTHING_TYPES:
+                positions = []
+                for it in wardrobe.get(clothing_type, []):
+                    found = self._positions.get(it['id'])
+                    if found is None or found[0] != clothing_type:
+                        return None
+                    positions.append(found[1])
+                indices[clothing_type] = np.array(positions, dtype=np.intp)
+            return {
+                (a, b): self.scores[a, b][np.ix_(indices[a], indices[b])]
+                for a, b in CATEGORY_PAIRS
+            }
+
+
+_matrices = OrderedDict()  # wardrobe_id -> PairScoreMatrix
+_matrices_lock = threading.Lock()
+
+
+def get_pair_scores(wardrobe_id, wardrobe):
+    """Cached PairScoreMatrix for a wardrobe, built on first use and topped up with any items it is missing."""
+    with _matrices_lock:
+        matrix = _matrices.get(wardrobe_id)
+        if matrix is None:
+            matrix = _matrices[wardrobe_id] = PairScoreMatrix()
+            while len(_matrices) > PAIR_SCORE_CACHE_SIZE:
+                _matrices.popitem(last=False)
+        else:
+            _matrices.move_to_end(wardrobe_id)
+    # items uploaded through another worker are simply appended
+    matrix.add_items(wardrobe)
+    return matrix
+
+
+def item_added(wardrobe_id, clothing_type, item):
+    # Only wardrobes already in memory are updated; others are built on their next read
+    matrix = _matrices.get(wardrobe_id)
+    if matrix is not None:
+        matrix.add_item(clothing_type, item)
+
+
+def item_removed(wardrobe_id, item_id):
+    matrix = _matrices.get(wardrobe_id)
+    if matrix is not None:
+        matrix.remove_item(item_id)
+
+
+def forget_wardrobe(wardrobe_id):
+    with _matrices_lock:
+        _matrices.pop(wardrobe_id, None)
@@ -0,0 +1,47 @@
+import os
+from PIL import Image, ImageOps
+
+# Downscaled copies stored next to each upload as <upload>~<size>.<ext>. Uploads are named
+# with secure_filename, which never keeps a "~", so a variant cannot collide with an upload.
+# The format they were written in is recorded on the item (or user) row, see thumbnail_filename.
+THUMBNAIL_SIZES = (128, 512)
+THUMBNAIL_FORMAT = os.getenv('THUMBNAIL_FORMAT', 'webp').lower()  # webp or jpeg
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 80))
+
+_EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+
+def variant_filename(filename, size, thumbnail_format=THUMBNAIL_FORMAT):
+    return f"{filename}~{size}.{_EXTENSIONS[thumbnail_format]}"
+
+
+def is_variant(filename):
+    return '~' in filename
+
+
+def make_variants(upload_folder, filename, sizes=THUMBNAIL_SIZES):
+    """Writes every size variant of an uploaded image in THUMBNAIL_FORMAT and returns their filenames."""
+    with Image.open(os.path.join(upload_folder, filename)) as image:
+        image.draft('RGB', (max(sizes), max(sizes)))
+        image = ImageOps.exif_transpose(image)  # phone photos store their rotation in EXIF
+        keep_alpha = THUMBNAIL_FORMAT == 'webp' and image.mode in ('RGBA', 'LA', 'P')
+        image = image.convert('RGBA' if keep_alpha else 'RGB')
+
+        written = []
+        for size in sorted(sizes, reverse=True):
+            # each step shrinks the previous (larger) one instead of the full image
+            image.thumbnail((size, size))
+            name = variant_filename(filename, size)
+            image.save(os.path.join(upload_folder, name), THUMBNAIL_FORMAT.upper(), quality=THUMBNAIL_QUALITY)
+            written.append(name)
+    return written
+
+
+def thumbnail_filename(filename, size, thumbnail_format=None):
+    """
+    Variant to serve for an upload whose variants were written in thumbnail_format
+    (as recorded on its row), or the original while it has none.
+    """
+    if not filename or not thumbnail_format:
+        return filename
+    return variant_filename(filename, size, thumbnail_format)
@@ -0,0 +1,195 @@
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+from colors_test import get_dominant_color, get_palette, _closest_color_name
+from db import insert_clothing_item, insert_clothing_items, insert_upload_job, finish_upload_job, fetch_upload_job
+from thumbnails import make_variants, THUMBNAIL_FORMAT
+
+# Background threads processing uploads; 0 runs every job inline on submit (tests, local dev)
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 2))
+# Seconds a finished job is kept for status lookups (upload_jobs table)
+UPLOAD_JOBS_KEEP_SECONDS = int(os.getenv('UPLOAD_JOBS_KEEP_SECONDS', 24 * 3600))
+# A job still pending after this many seconds died with its process and is reported failed
+UPLOAD_JOB_TIMEOUT = int(os.getenv('UPLOAD_JOB_TIMEOUT', 600))
+# Processes decoding images of a batch upload in parallel; 0 decodes them in the request thread
+BATCH_UPLOAD_PROCESSES = int(os.getenv('BATCH_UPLOAD_PROCESSES', os.cpu_count() or 1))
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def extract_upload(file_path, filename):
+    """
+    Image work of one upload (dominant color, palette, name, thumbnails).
+    Returns (rgb, color_name, palette, thumbnail_format), thumbnail_format None when no variants were written.
+    """
+    with Image.open(file_path) as image:
+        rgb = get_dominant_color(image)
+        palette = get_palette(image)
+    # variants exist before the item shows up; without them templates fall back to the original
+    try:
+        make_variants(os.path.dirname(file_path), filename)
+        thumbnail_format = THUMBNAIL_FORMAT
+    except Exception as e:
+        print(f"Thumbnails for {filename} failed:", e)
+        thumbnail_format = None
+    return rgb, _closest_color_name(rgb), palette, thumbnail_format
+
+
+def process_upload(wardrobe_id, category, file_path, filename):
+    """Color extraction + DB insert for a saved upload. Returns the job result fields."""
+    rgb, color_name, palette, thumbnail_format = extract_upload(file_path, filename)
+    item_id = insert_clothing_item(wardrobe_id, category, rgb, filename, color_name, palette, thumbnail_format)
+    return {'item_id': item_id, 'rgb': rgb, 'color_name': color_name}
+
+
+# Pool processes come from a fork server (spawned where there is none): forking the web
+# worker itself would copy locks held by its other threads (uploads, ELK logger)
+_MP_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+_process_pool = None
+_process_pool_pid = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+    # created on first batch, and again in a forked worker that inherited its parent's pool
+    global _process_pool, _process_pool_pid
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_pid != os.getpid():
+            _process_pool = ProcessPoolExecutor(max_workers=BATCH_UPLOAD_PROCESSES,
+                                                mp_context=multiprocessing.get_context(_MP_START_METHOD))
+            _process_pool_pid = os.getpid()
+        return _process_pool
+
+
+def _discard_process_pool(pool):
+    # a crashed worker breaks the pool, start a fresh one next time
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False)
+
+
+def process_batch_upload(wardrobe_id, uploads):
+    """
+    uploads: [(category, file_path, filename), …] already saved to disk.
+    Images are decoded in parallel, then every readable one is inserted with a single
+    multi-row INSERT. Returns one result per upload, in order:
+    {'filename', 'category', 'status': done/failed, 'item_id', 'rgb', 'color_name'} or {…, 'error'}.
+    """
+    results = [{'filename': filename, 'category': category} for category, _, filename in uploads]
+    if BATCH_UPLOAD_PROCESSES and len(uploads) > 1:
+        pool = _get_process_pool()
+        futures = [pool.submit(extract_upload, file_path, filename) for _, file_path, filename in uploads]
+        extract = [f.exception() or f.result() for f in futures]
+        if any(isinstance(e, BrokenProcessPool) for e in extract):
+            _discard_process_pool(pool)
+    else:
+        extract = []
+        for _, file_path, filename in uploads:
+            try:
+                extract.append(extract_upload(file_path, filename))
+            except Exception as e:
+                extract.append(e)
+
+    items = []
+    for result, (category, _, filename), extracted in zip(results, uploads, extract):
+        if isinstance(extracted, Exception):
+            print(f"Batch upload of {filename} failed:", extracted)
+            result.update(status=FAILED, error=str(extracted))
+            continue
+        rgb, color_name, palette, thumbnail_format = extracted
+        result.update(rgb=rgb, color_name=color_name)
+        items.append((result, {'type': category, 'rgb': rgb, 'image': filename, 'color_name': color_name,
+                               'palette': palette, 'thumbnail_format': thumbnail_format}))
+
+    try:
+        ids = insert_clothing_items(wardrobe_id, [item for _, item in items])
+    except Exception as e:
+        print("Batch upload insert failed:", e)
+        for result, _ in items:
+            result.update(status=FAILED, error="Could not save the item")
+    else:
+        for (result, _), item_id in zip(items, ids):
+            result.update(status=DONE, item_id=item_id)
+    return results
+
+
+class UploadQueue:
+    """
+    Upload pipeline: submit() records a pending job and hands it to a thread pool,
+    status() reports pending/done/failed. Jobs live in the upload_jobs table, so any
+    server process can report a job another one is running. No external broker needed.
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS, keep_seconds=UPLOAD_JOBS_KEEP_SECONDS, timeout=UPLOAD_JOB_TIMEOUT,
+                 process=process_upload):
+        self.workers = workers
+        self.keep_seconds = keep_seconds
+        self.timeout = timeout
+        self.process = process
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # created lazily so the threads start in the process that serves requests;
+        # a forked worker does not inherit the parent's threads, so it starts its own
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='upload')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def submit(self, wardrobe_id, category, file_path, filename):
+        job = {
+            'id': uuid.uuid4().hex,
+            'wardrobe_id': wardrobe_id,
+            'category': category,
+            'filename': filename
+        }
+        insert_upload_job(job['id'], wardrobe_id, category, filename, PENDING, self.keep_seconds)
+
+        if self.workers:
+            self._get_executor().submit(self._run, job, file_path)
+        else:
+            self._run(job, file_path)
+        return job['id']
+
+    def _run(self, job, file_path):
+        try:
+            result = self.process(job['wardrobe_id'], job['category'], file_path, job['filename'])
+        except Exception as e:
+            print(f"Upload job {job['id']} failed:", e)
+            finish_upload_job(job['id'], FAILED, error=str(e))
+        else:
+            finish_upload_job(job['id'], DONE, **result)
+
+    def status(self, job_id):
+        job = fetch_upload_job(job_id)
+        if job is None:
+            return None
+        if job['status'] == PENDING and job['age'] > self.timeout:
+            # the process running it was killed or restarted before it finished
+            finish_upload_job(job_id, FAILED, error="Upload was interrupted")
+            job = fetch_upload_job(job_id)
+            if job is None:
+                return None
+        del job['age']
+        return job
+
+    def shutdown(self, wait=True):
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._executor_pid == os.getpid():
+            executor.shutdown(wait=wait)
+
+
+upload_queue = UploadQueue()
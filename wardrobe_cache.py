@@ -0,0 +1,170 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# memory:// keeps wardrobes per process; redis://host:port/db shares them across workers
+WARDROBE_CACHE_URL = os.getenv('WARDROBE_CACHE_URL', 'memory://')
+WARDROBE_CACHE_TTL = int(os.getenv('WARDROBE_CACHE_TTL', 300))      # seconds
+WARDROBE_CACHE_SIZE = int(os.getenv('WARDROBE_CACHE_SIZE', 1024))   # entries, memory:// only
+
+
+class LocalBackend:
+    """In-process TTL + LRU store. Counters are kept apart and never evicted."""
+
+    def __init__(self, max_entries=WARDROBE_CACHE_SIZE, ttl=WARDROBE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._values = OrderedDict()  # key -> (expires_at, value)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._values[key]
+                return None
+            self._values.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._values[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key)
+
+    def add_counter(self, key, value):
+        with self._lock:
+            self._counters.setdefault(key, value)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisBackend:
+    """Shared store on top of a redis-py compatible client (values are pickled)."""
+
+    def __init__(self, client, ttl=WARDROBE_CACHE_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, key):
+        raw = self.client.get(key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, pickle.dumps(value), ex=ttl or self.ttl)
+
+    def get_counter(self, key):
+        raw = self.client.get(key)
+        return int(raw) if raw is not None else None
+
+    def add_counter(self, key, value):
+        self.client.set(key, value, nx=True)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+
+class FakeRedis:
+    """Dict stand-in for the get/set/incr subset of redis-py used by RedisBackend (tests, local dev)."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+                return None
+            return entry[1]
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and key in self._data:
+                return None
+            if not isinstance(value, bytes):
+                value = str(value).encode()
+            self._data[key] = (time.monotonic() + ex if ex else None, value)
+            return True
+
+    def incr(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            value = int(entry[1]) + 1 if entry else 1
+            self._data[key] = (entry[0] if entry else None, str(value).encode())
+            return value
+
+
+class WardrobeCache:
+    """
+    Wardrobe items keyed by wardrobe_id and a per-wardrobe version counter.
+    Write paths call bump() after committing, which moves readers to a new key.
+    With a shared backend (redis://) the counter is shared too, so no worker serves
+    a stale entry; LocalBackend keeps it per process, so other processes only see
+    the change once their entry expires.
+    Cached wardrobes are shared between requests and must not be mutated.
+    """
+
+    def __init__(self, backend, loader):
+        self.backend = backend
+        self.loader = loader
+
+    def _version_key(self, wardrobe_id):
+        return f"wardrobe:{wardrobe_id}:version"
+
+    def version(self, wardrobe_id):
+        key = self._version_key(wardrobe_id)
+        version = self.backend.get_counter(key)
+        if version is None:
+            # a lost counter restarts from a fresh value, never from a number used before
+            self.backend.add_counter(key, time.time_ns())
+            version = self.backend.get_counter(key)
+        return version
+
+    def get(self, wardrobe_id):
+        key = f"wardrobe:{wardrobe_id}:v{self.version(wardrobe_id)}"
+        wardrobe = self.backend.get(key)
+        if wardrobe is None:
+            wardrobe = self.loader(wardrobe_id)
+            self.backend.set(key, wardrobe)
+        return wardrobe
+
+    def get_derived(self, wardrobe_id, name, compute, ttl=None):
+        """
+        compute(wardrobe), cached under the wardrobe's current version, so it is
+        recomputed after the next bump(). ttl overrides the backend's default.
+        """
+        key = f"wardrobe:{wardrobe_id}:v{self.version(wardrobe_id)}:{name}"
+        value = self.backend.get(key)
+        if value is None:
+            value = compute(self.get(wardrobe_id))
+            self.backend.set(key, value, ttl)
+        return value
+
+    def bump(self, wardrobe_id):
+        if wardrobe_id is None:
+            return
+        self.version(wardrobe_id)
+        self.backend.incr(self._version_key(wardrobe_id))
+
+
+def create_backend(url=WARDROBE_CACHE_URL):
+    if url.startswith('memory://'):
+        return LocalBackend()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        import redis
+        return RedisBackend(redis.Redis.from_url(url))
+    raise ValueError(f"Unsupported WARDROBE_CACHE_URL: {url}")